@@ -1,12 +1,12 @@
-import re
 import os
 import json
-import datetime
-import yaml
+import hashlib
+from bbc_stats import profiling
+from bbc_stats import serializers
+from bbc_stats.store import ResultsStore, MONTH_IDX, ROUND_REGEXP, parse_round_name
 
 __version__ = '1.0.8'
-MONTH_IDX=['january', 'february', 'march', 'april', 'may', 'june', 'july',
-           'august', 'september', 'october', 'november', 'december']
+MANIFEST_FILENAME = ".bbc-stats-manifest.json"
 
 
 class GithubSiteBase(object):
@@ -14,28 +14,28 @@ class GithubSiteBase(object):
     output_format = "yaml"
     output_kwargs = {}
 
-    def __init__(self, results_directory, points_config={"fw": 1, "s": 1, "fr": 1, "ba": 1, "ov": 1 },
+    def __init__(self, results_store, points_config={"fw": 1, "s": 1, "fr": 1, "ba": 1, "ov": 1 },
                  blacklisted_rounds=None, stats_obj=None):
+        """
+
+        :param results_store: A ResultsStore (or path to a results directory) to read rounds from
+        :param points_config: Points configuration
+        :param blacklisted_rounds: Round names that are not official
+        :param stats_obj: golfgenius.stats.Stats object
+        """
+        if not isinstance(results_store, ResultsStore):
+            results_store = ResultsStore(results_store)
         self.rounds = None
         self.invalid_rounds = {}
         self.players = None
         self.stats = stats_obj
+        self.export_counts = None
         self.points_config = points_config
-        self.results_directory = results_directory
-        self.results = {}
+        self.store = results_store
+        self.results_directory = results_store.results_directory
+        self.results = results_store.results
         self.blacklisted_rounds = blacklisted_rounds or []
-        self.round_regexp = re.compile(
-            r'Round\s+(?P<round_id>\d+)\s+\((Fri|Sat|Sun|Mon|Tue|Wed|Thu)\,\s+(?P<month>\w+)\s+(?P<day>\d+)\)')
-        for f in os.listdir(self.results_directory):
-            if f.endswith('.json'):
-                with open(os.path.join(self.results_directory, f), 'r') as fp:
-                    data = json.load(fp)
-                    round_date = self.parse_round_name(data["name"])
-                    if round_date is None:
-                        print("Unable to find round_info date for round_info %s, assuming today..." % data["name"])
-                        round_date = datetime.date.today()
-                    data["results"]["date"] = round_date
-                    self.results[data["name"]] = data["results"]
+        self.round_regexp = ROUND_REGEXP
 
     def add_rounds(self, round_data):
         self.rounds = round_data
@@ -44,49 +44,84 @@ class GithubSiteBase(object):
         self.players = players_data
 
     def parse_round_name(self, name):
-        m = self.round_regexp.search(name)
-        if m:
-            round_info = m.groupdict()
-            year = 2021
-            return datetime.date(
-                year,
-                MONTH_IDX.index(
-                    round_info["month"].lower()) + 1,
-                int(round_info["day"]))
+        return parse_round_name(name, self.store.default_year)
 
     def all_players(self):
-        players = set()
-        for result in self.results.values():
-            for team in result["teams"]:
-                for player in team:
-                    players.add(player)
-        return list(players)
+        return self.store.all_players()
 
     def parse(self):
         raise NotImplementedError("Base classes must implement parse method.")
 
-    def _write_yaml(self, data, project_root_dir):
-        for k, v in data.items():
-            with open(os.path.join(project_root_dir, self.output_path, k + ".md"), "w") as fp:
-                yaml_str = yaml.dump(v, **self.output_kwargs)
-                fp.write("---\n")
-                fp.write(yaml_str)
-                fp.write("---\n")
+    def _serialize_yaml(self, value):
+        return "---\n" + serializers.dump_yaml(value, **self.output_kwargs) + "---\n"
+
+    def _serialize_json(self, value):
+        return serializers.dump_json(value, **self.output_kwargs)
+
+    def _read_manifest(self, output_dir):
+        manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+        if not os.path.isfile(manifest_path):
+            return {}
+        with open(manifest_path, "r") as fp:
+            return json.load(fp)
 
-    def _write_json(self, data, project_root_dir):
+    def _write_manifest(self, output_dir, manifest):
+        with open(os.path.join(output_dir, MANIFEST_FILENAME), "w") as fp:
+            json.dump(manifest, fp, indent=4, sort_keys=True)
+
+    def _write_files(self, data, project_root_dir, extension, serializer, incremental=False):
+        """
+        Writes one file per data item and records a content hash of each in the output manifest.
+
+        In incremental mode files whose serialized content matches the manifest are left untouched
+        and files from the previous manifest that are no longer produced are removed.
+        """
+        output_dir = os.path.join(project_root_dir, self.output_path)
+        previous = self._read_manifest(output_dir) if incremental else {}
+        manifest = {}
+        counts = {"written": 0, "skipped": 0, "removed": 0}
         for k, v in data.items():
-            with open(os.path.join(project_root_dir, self.output_path, k + ".json"), "w") as fp:
-                json.dump(v, fp, **self.output_kwargs)
+            filename = k + extension
+            path = os.path.join(output_dir, filename)
+            with profiling.stage("%s.serialize" % self.__class__.__name__):
+                content = serializer(v)
+            digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+            manifest[filename] = digest
+            if incremental and previous.get(filename) == digest and os.path.isfile(path):
+                counts["skipped"] += 1
+                continue
+            with open(path, "w") as fp:
+                fp.write(content)
+            counts["written"] += 1
+        for filename in previous:
+            if filename not in manifest:
+                path = os.path.join(output_dir, filename)
+                if os.path.isfile(path):
+                    os.remove(path)
+                counts["removed"] += 1
+        self._write_manifest(output_dir, manifest)
+        self.export_counts = counts
+        print("Exported %s: %d written, %d skipped, %d removed" % (
+            self.output_path, counts["written"], counts["skipped"], counts["removed"]))
+        return counts
+
+    def _write_yaml(self, data, project_root_dir, incremental=False):
+        return self._write_files(data, project_root_dir, ".md", self._serialize_yaml, incremental)
+
+    def _write_json(self, data, project_root_dir, incremental=False):
+        return self._write_files(data, project_root_dir, ".json", self._serialize_json, incremental)
 
-    def export(self, project_root_dir):
-        data = self.parse(project_root_dir)
+    def export(self, project_root_dir, incremental=False):
+        with profiling.stage("%s.parse" % self.__class__.__name__):
+            data = self.parse(project_root_dir)
         if data:
             if not os.path.isdir(os.path.join(project_root_dir, self.output_path)):
                 os.makedirs(os.path.join(project_root_dir, self.output_path), exist_ok=True)
-            if self.output_format == "yaml":
-                self._write_yaml(data, project_root_dir)
-            elif self.output_format == "json":
-                self._write_json(data, project_root_dir)
-            else:
-                raise Exception("Unknown output format: %s" % self.output_format)
+            with profiling.stage("%s.write" % self.__class__.__name__):
+                if self.output_format == "yaml":
+                    self._write_yaml(data, project_root_dir, incremental=incremental)
+                elif self.output_format == "json":
+                    self._write_json(data, project_root_dir, incremental=incremental)
+                else:
+                    raise Exception("Unknown output format: %s" % self.output_format)
         return data
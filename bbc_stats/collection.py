@@ -1,7 +1,13 @@
 from bbc_stats import GithubSiteBase
+from bbc_stats.scoring import RoundScores
+from bbc_stats.selection import ReplaceRounds, selection_rule
+from bbc_stats.derived import SCORING, POINTS, SCORING_KEYS, POINTS_KEYS, round_key, points_key
 from operator import itemgetter
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import os
+import copy
+import math
 import datetime
 
 
@@ -47,100 +53,79 @@ class RoundsCollection(GithubSiteBase):
     output_format = "yaml"
     output_kwargs = {}
 
+    def __init__(self, *args, jobs=1, derived_cache=None, **kwargs):
+        """
+        :param jobs: Number of processes used to parse rounds
+        :param derived_cache: derived.DerivedCache to reuse scoring and points of unchanged rounds from
+        """
+        super().__init__(*args, **kwargs)
+        self.jobs = jobs
+        self.parsed = {}
+        self.derived_cache = derived_cache
+
+    def prime(self, round_name):
+        """
+        Parses one round ahead of parse(), e.g. while later rounds are still being synced.
+        parse() reuses the primed result as long as the round is not primed again or removed.
+        """
+        self.parsed[round_name] = self.parse_round(round_name, self.results[round_name])
+
     def team_best_ball(self, round, hole_range, team, best_ball=2):
-        total_scores = []
-        for hole in hole_range:
-            hole_scores = []
-            for player in team:
-                if str(hole) in round["scores"][player]["scores"]:
-                    hole_scores.append(round["scores"][player]["scores"][str(hole)]["score"])
-            total_scores.extend(sorted(hole_scores)[:best_ball])
-        return sum(total_scores)
-
-    def parse_teams(self, round):
+        scores = RoundScores({"scores": round["scores"], "teams": [team]})
+        return int(scores.team_best_ball(hole_range, best_ball=best_ball)[0])
+
+    def parse_teams(self, round, scores=None):
+        scores = scores or RoundScores(round)
+        front = scores.team_best_ball(range(1, 10))
+        back = scores.team_best_ball(range(10, 19))
+        overall = scores.team_best_ball(range(1, 19))
+        front_win, back_win, overall_win = front.min(), back.min(), overall.min()
+        front_split = int((front == front_win).sum())
+        back_split = int((back == back_win).sum())
+        overall_split = int((overall == overall_win).sum())
         teams = []
-        for team in round["teams"]:
-            teams.append({
+        for team_idx, team in enumerate(round["teams"]):
+            team_data = {
                 "players": [
                     {
                         "name": player,
                         "flight": flight,
-                        "score": sum(
-                            [x["score"] for x in round["scores"][player]["scores"].values()])
+                        "score": int(scores.totals[scores.index[player]])
                     } for flight, player in enumerate(team)],
-                "front": self.team_best_ball(round, range(1, 10), team),
-                "back": self.team_best_ball(round, range(10, 19), team),
-                "overall": self.team_best_ball(round, range(1, 19), team)
-            })
-        front, back, overall = [], [], []
-        for team in teams:
-            front.append(team["front"])
-            back.append(team["back"])
-            overall.append(team["overall"])
-        front_win = sorted(set(front))[0]
-        front_split = front.count(front_win)
-        back_win = sorted(set(back))[0]
-        back_split = back.count(back_win)
-        overall_win = sorted(set(overall))[0]
-        overall_split = overall.count(overall_win)
-        for team in teams:
-            if team["front"] == front_win:
-                team["front"] = True
-                team["front_split"] = front_split
-            else:
-                team["front"] = False
-            if team["back"] == back_win:
-                team["back"] = True
-                team["back_split"] = back_split
-            else:
-                team["back"] = False
-            if team["overall"] == overall_win:
-                team["overall"] = True
-                team["overall_split"] = overall_split
-            else:
-                team["overall"] = False
+                "front": bool(front[team_idx] == front_win),
+                "back": bool(back[team_idx] == back_win),
+                "overall": bool(overall[team_idx] == overall_win)
+            }
+            if team_data["front"]:
+                team_data["front_split"] = front_split
+            if team_data["back"]:
+                team_data["back_split"] = back_split
+            if team_data["overall"]:
+                team_data["overall_split"] = overall_split
+            teams.append(team_data)
         return teams
 
-    def parse_flight_split(self, round):
-        flights = defaultdict(list)
-        for team in round["teams"]:
-            for idx, player in enumerate(team):
-                if player in round["scores"] and len(round["scores"][player]["scores"]) == 18:
-                    flights[idx].append((player, sum([s["score"] for s in round["scores"][player]["scores"].values()])))
-        flight_split = []
-        for idx, items in flights.items():
-            winning_score = sorted(set([x[1] for x in items]))[0]
-            split = [x[1] for x in items].count(winning_score)
-            flight_split.append(split)
-        return flight_split
-
-    def parse_flight_winners(self, round):
-        flights = defaultdict(list)
-        for team in round["teams"]:
-            for idx, player in enumerate(team):
-                if player in round["scores"] and len(round["scores"][player]["scores"]) == 18:
-                    flights[idx].append((player, sum([s["score"] for s in round["scores"][player]["scores"].values()])))
-        flight_winners = defaultdict(list)
-        for idx, items in flights.items():
-            winning_score = sorted(set([x[1] for x in items]))[0]
-            for player, score in items:
-                if score == winning_score:
-                    flight_winners[idx].append(player)
-        return dict(flight_winners)
-
-    def parse_skins(self, round):
-        hole_scores = defaultdict(list)
-        for hole in range(1, 19):
-            for player, result in round["scores"].items():
-                if str(hole) in result["scores"]:
-                    score = result["scores"][str(hole)]["score"]
-                    hole_scores[hole].append((player, score))
-        skins = defaultdict(list)
-        for hole, items in hole_scores.items():
-            sorted_items = sorted(items, key=itemgetter(1))
-            if sorted_items[0][1] < sorted_items[1][1]:
-                skins[sorted_items[0][0]].append(hole)
-        return dict(skins)
+    def parse_flight_split(self, round, scores=None):
+        scores = scores or RoundScores(round)
+        return [split for _, _, split in scores.flights()]
+
+    def parse_flight_winners(self, round, scores=None):
+        scores = scores or RoundScores(round)
+        return {flight: winners for flight, winners, _ in scores.flights()}
+
+    def parse_skins(self, round, scores=None):
+        scores = scores or RoundScores(round)
+        return scores.skins()
+
+    def score_round(self, round):
+        """ Teams with their nassau results, flight winners, flight splits and skins of a round """
+        scores = RoundScores(round)
+        return {
+            "teams": self.parse_teams(round, scores=scores),
+            "flight_winners": self.parse_flight_winners(round, scores=scores),
+            "flight_splits": self.parse_flight_split(round, scores=scores),
+            "skins": self.parse_skins(round, scores=scores)
+        }
 
     def check_round_valid(self, round_name, round_info):
         # Check if round blacklisted
@@ -202,49 +187,193 @@ class RoundsCollection(GithubSiteBase):
                     round_data["points"][player_name] += self.points_config["ov"] / team["overall_split"]
                     round_data["total_points"] += self.points_config["ov"] / team["overall_split"]
 
-    def parse(self, project_root_dir):
-        data = {}
-        print("Parsing rounds with blacklist: %s" % self.blacklisted_rounds)
-        for round_name, round in self.results.items():
-            print("Parsing %s" % round_name)
-            valid_round, reason = self.check_round_valid(round_name, round)
-            if not valid_round:
-                self.invalid_rounds[round_name] = reason
-                data[round_name] = {
-                    "name": round_name,
-                    "valid": False,
-                    "reason": reason,
-                    "date": str(round["date"]),
-                    "date_timestamp": round["date"].toordinal(),
-                    "gg_url": round.get("gg_url"),
-                    "total_points": 0,
-                    "points": {}
-                }
-                continue
-            data[round_name] = {
+    def parse_round(self, round_name, round):
+        """
+        Parses a single round.
+
+        :return: Tuple (round_data, reason) where reason is None for valid rounds
+        """
+        valid_round, reason = self.check_round_valid(round_name, round)
+        if not valid_round:
+            return {
                 "name": round_name,
-                "valid": True,
+                "valid": False,
+                "reason": reason,
                 "date": str(round["date"]),
                 "date_timestamp": round["date"].toordinal(),
                 "gg_url": round.get("gg_url"),
-                "teams": self.parse_teams(round),
-                "flight_winners": self.parse_flight_winners(round),
-                "flight_splits": self.parse_flight_split(round),
-                "skins": self.parse_skins(round)
-            }
-            try:
-                self.add_points(data[round_name])
-            except Exception as exc:
-                import json
-                print(json.dumps(data[round_name], indent=4, default=str))
-                raise
+                "total_points": 0,
+                "points": {}
+            }, reason
+        round_data = {
+            "name": round_name,
+            "valid": True,
+            "date": str(round["date"]),
+            "date_timestamp": round["date"].toordinal(),
+            "gg_url": round.get("gg_url")
+        }
+        if self.derived_cache is None:
+            round_data.update(self.score_round(round))
+            self._add_points(round_data)
+            return round_data, None
+        scoring_key = self.derived_key(round_name, round)
+        scoring = self.derived_cache.get(SCORING, scoring_key)
+        if scoring is None:
+            self.derived_cache.misses += 1
+            scoring = self.score_round(round)
+            self.derived_cache.put(SCORING, scoring_key, scoring)
+        else:
+            self.derived_cache.hits += 1
+        round_data.update(scoring)
+        round_points_key = points_key(scoring_key, self.points_config)
+        points = self.derived_cache.get(POINTS, round_points_key)
+        if points is None:
+            self._add_points(round_data)
+            self.derived_cache.put(POINTS, round_points_key, {key: round_data[key] for key in POINTS_KEYS})
+        else:
+            round_data.update(points)
+        return round_data, None
+
+    def _add_points(self, round_data):
+        try:
+            self.add_points(round_data)
+        except Exception:
+            import json
+            print(json.dumps(round_data, indent=4, default=str))
+            raise
+
+    def derived_key(self, round_name, round):
+        # The store has the content hash of round files, only rounds not read from a file are hashed here
+        return self.store.hashes.get(round_name) or round_key(round)
+
+    def memoize(self, round_name, round_data):
+        """ Stores the derived results of a round parsed without the derived cache, e.g. by a worker """
+        if self.derived_cache is None or not round_data["valid"]:
+            return
+        self.derived_cache.misses += 1
+        scoring_key = self.derived_key(round_name, self.results[round_name])
+        self.derived_cache.put(SCORING, scoring_key, {key: round_data[key] for key in SCORING_KEYS})
+        self.derived_cache.put(POINTS, points_key(scoring_key, self.points_config),
+                               {key: round_data[key] for key in POINTS_KEYS})
+
+    def _parse_serial(self, rounds):
+        for round_name, round in rounds:
+            print("Parsing %s" % round_name)
+            round_data, reason = self.parse_round(round_name, round)
+            yield round_name, round_data, reason
+
+    def _parse_parallel(self, rounds):
+        if self.derived_cache is not None:
+            # Rounds with cached scoring are parsed right here, only the others are worth a worker
+            cached = [(round_name, round) for round_name, round in rounds
+                      if self.derived_cache.contains(SCORING, self.derived_key(round_name, round))]
+            for parsed in self._parse_serial(cached):
+                yield parsed
+            cached_names = set(round_name for round_name, _ in cached)
+            rounds = [(round_name, round) for round_name, round in rounds if round_name not in cached_names]
+            if not rounds:
+                return
+        # Workers only need the configuration, not every loaded round
+        worker = copy.copy(self)
+        worker.results = {}
+        worker.parsed = {}
+        worker.store = None
+        worker.derived_cache = None
+        chunk_size = max(1, int(math.ceil(len(rounds) / float(self.jobs * 4))))
+        chunks = [rounds[idx:idx + chunk_size] for idx in range(0, len(rounds), chunk_size)]
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(_parse_round_chunk, worker, chunk) for chunk in chunks]
+            for future in futures:
+                for parsed in future.result():
+                    self.memoize(parsed[0], parsed[1])
+                    yield parsed
+
+    def parse(self, project_root_dir):
+        data = {}
+        self.invalid_rounds = {}
+        print("Parsing rounds with blacklist: %s" % self.blacklisted_rounds)
+        rounds = [(round_name, round) for round_name, round in self.results.items() if round_name not in self.parsed]
+        if self.jobs > 1 and len(rounds) > 1:
+            parsed_rounds = self._parse_parallel(rounds)
+        else:
+            parsed_rounds = self._parse_serial(rounds)
+        # Parsed rounds are kept, drop a round from self.parsed to parse it again
+        for round_name, round_data, reason in parsed_rounds:
+            self.parsed[round_name] = round_data, reason
+        if self.derived_cache is not None:
+            print("Derived round results: %d cached, %d computed" % (
+                self.derived_cache.hits, self.derived_cache.misses))
+            self.derived_cache.hits = self.derived_cache.misses = 0
+            self.derived_cache.flush()
+        for round_name in self.results:
+            round_data, reason = self.parsed[round_name]
+            if reason is not None:
+                self.invalid_rounds[round_name] = reason
+            data[round_name] = round_data
         return data
 
 
+def _parse_round_chunk(collection, chunk):
+    """ Process pool worker, parses a chunk of (round_name, round) items """
+    parsed = []
+    for round_name, round in chunk:
+        print("Parsing %s" % round_name)
+        try:
+            parsed.append((round_name,) + collection.parse_round(round_name, round))
+        except Exception as exc:
+            raise Exception("Unable to parse round %s: %r" % (round_name, exc))
+    return parsed
+
+
 class PlayersCollection(GithubSiteBase):
     output_path = "_players"
     output_format = "yaml"
     output_kwargs = {}
+    player_rounds = None
+    # Players from the previous parse, and the players whose rounds changed since (None recomputes all)
+    players_data = None
+    stale_players = None
+
+    def add_rounds(self, round_data):
+        super().add_rounds(round_data)
+        self.player_rounds = None
+
+    def index_rounds(self):
+        """
+        Builds an index of player name to the rounds that player appears in.
+
+        Each entry carries the round plus the player's team count, flight wins, skins and nassau
+        wins for that round. Entries are in the order of self.rounds.
+        """
+        index = defaultdict(list)
+        for round_name, round in self.rounds.items():
+            entries = {}
+            players = []
+            for flight_winners in round.get("flight_winners", {}).values():
+                players.extend((player, "flight_wins", 1) for player in set(flight_winners))
+            for player, holes in round.get("skins", {}).items():
+                players.append((player, "skins", len(holes)))
+            for team in round.get("teams", []):
+                for player in set(x["name"] for x in team["players"]):
+                    players.append((player, "teams", 1))
+                    for nassau in ("front", "back", "overall"):
+                        if team.get(nassau):
+                            players.append((player, nassau + "_wins", 1))
+            for player, key, count in players:
+                if player not in entries:
+                    entries[player] = {
+                        "name": round_name,
+                        "round": round,
+                        "teams": 0,
+                        "flight_wins": 0,
+                        "skins": 0,
+                        "front_wins": 0,
+                        "back_wins": 0,
+                        "overall_wins": 0
+                    }
+                    index[player].append(entries[player])
+                entries[player][key] += count
+        return dict(index)
 
     def generate_points(self, player, target, points_config):
         target["points"] = 0
@@ -257,30 +386,21 @@ class PlayersCollection(GithubSiteBase):
         target["rounds_by_month"] = defaultdict(list)
         target["ignored_rounds"] = []
         target["all_rounds"] = []
-        for round_name, round in self.rounds.items():
-            round_points = round["points"].get(player, 0)
-            played = False
-            for flight_winners in round.get("flight_winners", {}).values():
-                if player in flight_winners:
-                    target["flight_wins"] += 1
-
-            for _ in round.get("skins", {}).get(player, []):
-                target["skins"] += 1
-            for team in round.get("teams", []):
-                if player in [x["name"] for x in team["players"]]:
-                    target["rounds"] += 1
-                    played = True
-                    if team.get("front"):
-                        target["front_wins"] += 1
-                    if team.get("back"):
-                        target["back_wins"] += 1
-                    if team.get("overall"):
-                        target["overall_wins"] += 1
-            if played:
+        if self.player_rounds is None:
+            self.player_rounds = self.index_rounds()
+        for entry in self.player_rounds.get(player, []):
+            round = entry["round"]
+            target["flight_wins"] += entry["flight_wins"]
+            target["skins"] += entry["skins"]
+            target["rounds"] += entry["teams"]
+            target["front_wins"] += entry["front_wins"]
+            target["back_wins"] += entry["back_wins"]
+            target["overall_wins"] += entry["overall_wins"]
+            if entry["teams"]:
                 round_date = datetime.date.fromordinal(round["date_timestamp"])
                 this_round = {
-                    "name": round_name,
-                    "points": round_points,
+                    "name": entry["name"],
+                    "points": round["points"].get(player, 0),
                     "replaced_by": None,
                     "replaces": None,
                     "official": False,
@@ -290,69 +410,33 @@ class PlayersCollection(GithubSiteBase):
                 target["rounds_by_month"][round_date.month].append(this_round)
                 target["all_rounds"].append(this_round)
         target["all_rounds"] = sorted(target["all_rounds"], key=itemgetter("date"))
-        if points_config["max_rounds_per_month"] > 0:
-            for month, rounds in target["rounds_by_month"].items():
-                rounds_sorted = sorted(rounds, key=itemgetter("date"), reverse=True)
-                _ignored_rounds = []
-
-                if len(rounds_sorted) > points_config["max_rounds_per_month"]:
-                    valid_points = sum([r["points"] for r in rounds_sorted[0:points_config["max_rounds_per_month"]]])
-                    _ignored_rounds = [r["name"] for r in rounds_sorted[points_config["max_rounds_per_month"]:]]
-                    target["ignored_rounds"].extend(_ignored_rounds)
-                else:
-                    valid_points = sum([r["points"] for r in rounds_sorted])
-                target["points"] += valid_points
-                for round in rounds:
-                    if round["name"] in _ignored_rounds:
-                        round["ignored"] = True
-                    else:
-                        round["ignored"] = False
-            target["rounds_by_month"] = dict(target["rounds_by_month"])
-        else:
-            self.replace_rounds(target, points_config["season_round_count"], points_config["replacement_scores"])
+        selection_rule(points_config).select(target)
         # Convert defaultdict to dict
         target["rounds_by_month"] = dict(target["rounds_by_month"])
 
     def replace_rounds(self, target, season_round_count, replacement_scores):
-        all_rounds = target["all_rounds"]
-        sorted_by_points = list(sorted(list(all_rounds)[:season_round_count], key=itemgetter("points")))
-        extra_rounds = []
-        if len(all_rounds) > season_round_count:
-            extra_sorted = sorted(all_rounds[season_round_count:], key=itemgetter('points'), reverse=True)
-            extra_rounds = extra_sorted[:replacement_scores]
-        replaced = []
-        for maybe_official in all_rounds:
-            if maybe_official["name"] in [x["name"] for x in sorted_by_points]:
-                maybe_official["official"] = True
-                maybe_official["over_limit"] = False
-            else:
-                maybe_official["official"] = False
-                maybe_official["over_limit"] = True
-        for r in extra_rounds:
-            for idx, round in enumerate(sorted_by_points):
-                if r["points"] > round["points"] and idx not in replaced:
-                    replaced.append(idx)
-                    sorted_by_points[idx] = r
-                    for the_round in all_rounds:
-                        if the_round["name"] == round["name"]:
-                            the_round["replaced_by"] = r["name"]
-                            the_round["official"] = False
-                        if the_round["name"] == r["name"]:
-                            the_round["replaces"] = round["name"]
-                            the_round["official"] = True
-                    break
-        target["points"] = sum([r["points"] for r in all_rounds if r["official"]])
+        ReplaceRounds(season_round_count, replacement_scores).select(target)
 
     def parse(self, project_root_dir):
+        """
+        Computes every player's points. When stale_players is set only those players are recomputed,
+        the others keep their points from the previous parse.
+        """
         data = {}
         images_dir = os.path.join(project_root_dir, "assets", "images")
+        images = set(os.listdir(images_dir)) if os.path.isdir(images_dir) else set()
         for player in self.all_players():
             filename = '_'.join([x.strip() for x in player.split(",", 1)])
-            if filename + ".png" in os.listdir(images_dir):
+            if filename + ".png" in images:
                 player_image = "/assets/images/%s.png" % filename
             else:
                 player_image = "/assets/images/default.png"
+            if self.stale_players is not None and player not in self.stale_players and filename in (
+                    self.players_data or {}):
+                data[filename] = dict(self.players_data[filename], image=player_image)
+                continue
             data[filename] = {"name": player, "image": player_image}
             self.generate_points(player, data[filename], self.points_config)
-
+        self.players_data = data
+        self.stale_players = None
         return data
\ No newline at end of file
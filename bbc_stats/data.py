@@ -34,3 +34,39 @@ class GithubData(GithubSiteBase):
                     }
                     data[player_name]["rounds"].append(round_data)
         return data
+
+
+class GithubRankingsHistory(GithubSiteBase):
+    """ _data/rankings_history.json: the power rankings after every round date, see rankings.RankingsHistory """
+    output_path = "_data"
+    output_format = "json"
+    output_kwargs = {}
+
+    def __init__(self, results_store, history=None, rankings_weights=(1, 1, 1), **kwargs):
+        super(GithubRankingsHistory, self).__init__(results_store, **kwargs)
+        self.history = history
+        self.rankings_weights = rankings_weights
+
+    def parse(self, project_root_dir):
+        snapshots = []
+        previous_ranks = {}
+        for date, round_names, table in self.history.snapshots():
+            ranks, power_rankings = table.power_rankings(self.rankings_weights)
+            rankings = []
+            for rank, idx in enumerate(sorted(range(len(table.players)), key=lambda i: -power_rankings[i])):
+                player = table.players[idx]
+                rankings.append({
+                    "rank": rank + 1,
+                    "previous_rank": previous_ranks.get(player),
+                    "player": player,
+                    "power_ranking": float("%.3f" % power_rankings[idx]),
+                    "rounds": int(table.rounds[idx])
+                })
+            previous_ranks = {ranking["player"]: ranking["rank"] for ranking in rankings}
+            snapshots.append({
+                "date": str(date),
+                "date_timestamp": date.toordinal(),
+                "rounds": round_names,
+                "rankings": rankings
+            })
+        return {"rankings_history": snapshots}
@@ -0,0 +1,247 @@
+import os
+import json
+import sqlite3
+import hashlib
+import datetime
+import tempfile
+import threading
+from bbc_stats import profiling
+from bbc_stats.store import ResultsStore, parse_round_name
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rounds (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    date TEXT NOT NULL,
+    season INTEGER,
+    gg_url TEXT,
+    hash TEXT NOT NULL,
+    results TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rounds_date ON rounds (date);
+CREATE INDEX IF NOT EXISTS rounds_season ON rounds (season);
+CREATE TABLE IF NOT EXISTS teams (
+    round_id INTEGER NOT NULL,
+    team INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    PRIMARY KEY (round_id, team, position)
+);
+CREATE INDEX IF NOT EXISTS teams_player ON teams (player);
+CREATE TABLE IF NOT EXISTS player_rounds (
+    round_id INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    date TEXT NOT NULL,
+    holes INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    par INTEGER NOT NULL,
+    PRIMARY KEY (round_id, player)
+);
+CREATE INDEX IF NOT EXISTS player_rounds_player_date ON player_rounds (player, date);
+CREATE TABLE IF NOT EXISTS hole_scores (
+    round_id INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    hole INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    par INTEGER NOT NULL,
+    PRIMARY KEY (round_id, player, hole)
+);
+CREATE INDEX IF NOT EXISTS hole_scores_player ON hole_scores (player, hole);
+"""
+
+
+class ResultsDatabase(object):
+    """
+    SQLite copy of the results with indexed rounds, teams, player rounds and hole scores.
+
+    Round files stay the interchange format, every round keeps its results JSON next to the
+    normalized rows so it can be handed back to the collections unchanged. A round's date and
+    season are resolved when it is written: imports keep the date the ResultsStore gave it (season
+    metadata, else partition year, else default year), synced rounds use their season metadata,
+    else the writer's default year. Rounds written without a season by older versions are returned
+    by every date range query, like the unpartitioned root of a ResultsStore.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise Exception("Results database %s has schema version %d, expected %d" % (path, version, SCHEMA_VERSION))
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def _results_json(results):
+        return json.dumps({k: v for k, v in results.items() if k != "date"})
+
+    def upsert_round(self, round_name, results, round_date=None, default_year=None):
+        """
+        Inserts or replaces a round and its rows. Rounds with unchanged content and date are left untouched.
+
+        :param round_date: Date of the round, derived from its name and season metadata if None
+        :param default_year: Year of a round without season metadata when round_date is None, the
+                             default_year of the ResultsStore the same round would be imported from
+        :return: True if the round is new or changed
+        """
+        content = self._results_json(results)
+        digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        if round_date is None:
+            round_date = parse_round_name(round_name, results.get("season") or default_year) or datetime.date.today()
+        # The resolved season, so date range queries never need to guess the year of a round
+        season = round_date.year
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT id, hash, date, season FROM rounds WHERE name = ?",
+                                          (round_name,)).fetchone()
+            if row is not None and row["hash"] == digest and row["date"] == str(round_date) and \
+                    row["season"] == season:
+                return False
+            if row is not None:
+                for table in ("teams", "player_rounds", "hole_scores"):
+                    self.connection.execute("DELETE FROM %s WHERE round_id = ?" % table, (row["id"],))
+                self.connection.execute("UPDATE rounds SET date = ?, season = ?, gg_url = ?, hash = ?, results = ? "
+                                        "WHERE id = ?", (str(round_date), season,
+                                                         results.get("gg_url"), digest, content, row["id"]))
+                round_id = row["id"]
+            else:
+                round_id = self.connection.execute(
+                    "INSERT INTO rounds (name, date, season, gg_url, hash, results) VALUES (?, ?, ?, ?, ?, ?)",
+                    (round_name, str(round_date), season, results.get("gg_url"), digest,
+                     content)).lastrowid
+            self.connection.executemany(
+                "INSERT INTO teams (round_id, team, position, player) VALUES (?, ?, ?, ?)",
+                [(round_id, team_idx, position, player) for team_idx, team in enumerate(results["teams"])
+                 for position, player in enumerate(team)])
+            player_rounds = []
+            hole_scores = []
+            for player, info in results["scores"].items():
+                holes = info["scores"]
+                player_rounds.append((round_id, player, str(round_date), len(holes),
+                                      sum(hole["score"] for hole in holes.values()),
+                                      sum(hole["par"] for hole in holes.values())))
+                hole_scores.extend((round_id, player, int(hole), data["score"], data["par"])
+                                   for hole, data in holes.items())
+            self.connection.executemany(
+                "INSERT INTO player_rounds (round_id, player, date, holes, score, par) VALUES (?, ?, ?, ?, ?, ?)",
+                player_rounds)
+            self.connection.executemany(
+                "INSERT INTO hole_scores (round_id, player, hole, score, par) VALUES (?, ?, ?, ?, ?)", hole_scores)
+        return True
+
+    @profiling.timed("database.import")
+    def import_store(self, store):
+        """
+        Upserts every round of a ResultsStore, in the store's order.
+
+        :return: Tuple (new or changed rounds, unchanged rounds)
+        """
+        changed = 0
+        for round_name, results in store.results.items():
+            if self.upsert_round(round_name, results, round_date=results["date"]):
+                changed += 1
+        print("Imported %s into %s: %d new or changed, %d unchanged" % (
+            store.results_directory, self.path, changed, len(store.results) - changed))
+        return changed, len(store.results) - changed
+
+    def rounds(self, start_date=None, end_date=None):
+        """
+        Yields (round name, results, date) in insertion order, limited to a date range through the date index.
+        The results do not carry a "date", it is the stored date of the round.
+        """
+        query = "SELECT name, date, results FROM rounds"
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append("date >= ?")
+            params.append(str(start_date))
+        if end_date is not None:
+            conditions.append("date <= ?")
+            params.append(str(end_date))
+        if conditions:
+            query += " WHERE (%s) OR season IS NULL" % " AND ".join(conditions)
+        for row in self.connection.execute(query + " ORDER BY id", params):
+            yield row["name"], json.loads(row["results"]), datetime.date.fromisoformat(row["date"])
+
+    def player_rounds(self, player, limit=None, start_date=None):
+        """
+        A player's rounds newest first, e.g. player_rounds(player, limit=10) for their last 10 rounds.
+
+        :return: List of dicts with round, date, holes, score and par
+        """
+        query = ("SELECT rounds.name AS round, player_rounds.date, holes, score, par FROM player_rounds "
+                 "JOIN rounds ON rounds.id = player_rounds.round_id WHERE player = ?")
+        params = [player]
+        if start_date is not None:
+            query += " AND player_rounds.date >= ?"
+            params.append(str(start_date))
+        query += " ORDER BY player_rounds.date DESC, rounds.id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [dict(row) for row in self.connection.execute(query, params)]
+
+    def hole_scores(self, round_name, player=None):
+        """ [(player, hole, score, par), ...] of a round """
+        query = ("SELECT player, hole, score, par FROM hole_scores JOIN rounds ON rounds.id = hole_scores.round_id "
+                 "WHERE rounds.name = ?")
+        params = [round_name]
+        if player is not None:
+            query += " AND player = ?"
+            params.append(player)
+        return [tuple(row) for row in self.connection.execute(query + " ORDER BY player, hole", params)]
+
+
+class DatabaseStore(ResultsStore):
+    """
+    ResultsStore reading its rounds from a ResultsDatabase, so PowerRankings and every
+    GithubSiteBase collection can run on the database instead of the round files.
+
+    Only rounds within start_date to end_date are read. golfgenius Stats reads round files,
+    so stats_directory() writes the loaded rounds to a temporary directory.
+    """
+
+    def __init__(self, database, start_date=None, end_date=None, default_year=None):
+        if not isinstance(database, ResultsDatabase):
+            database = ResultsDatabase(database)
+        self.database = database
+        super(DatabaseStore, self).__init__(database.path, start_date=start_date, end_date=end_date,
+                                            default_year=default_year)
+
+    @profiling.timed("results.load")
+    def load(self):
+        self.results = {}
+        self.paths = {}
+        self.hashes = {}
+        self.loaded_rounds = 0
+        self.cached_rounds = 0
+        self._stats_view = None
+        # {file name: content} written to the stats view
+        self._stats_files = {}
+        for round_name, results, round_date in self.database.rounds(self.start_date, self.end_date):
+            self.add_round(round_name, results, round_date=round_date)
+            self.loaded_rounds += 1
+
+    def stats_directory(self):
+        """ Temporary directory holding a round file for every loaded round, and nothing else """
+        if self._stats_view is None:
+            self._stats_view = tempfile.TemporaryDirectory(prefix="bbc-stats-")
+        files = {}
+        for round_name, results in self.results.items():
+            files["{}.json".format(round_name)] = json.dumps(
+                {"name": round_name, "results": {k: v for k, v in results.items() if k != "date"}}, indent=4)
+        for f in list(self._stats_files):
+            if f not in files:
+                os.remove(os.path.join(self._stats_view.name, f))
+                del self._stats_files[f]
+        for f, content in files.items():
+            if self._stats_files.get(f) != content:
+                with open(os.path.join(self._stats_view.name, f), "w") as fp:
+                    fp.write(content)
+                self._stats_files[f] = content
+        return self._stats_view.name
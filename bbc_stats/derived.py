@@ -0,0 +1,117 @@
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+
+DERIVED_FILENAME = ".bbc-stats-derived.sqlite"
+# Bump when the values of a layer are computed differently
+DERIVED_VERSION = 1
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+SCORING = "scoring"
+POINTS = "points"
+SCORING_KEYS = ("teams", "flight_winners", "flight_splits", "skins")
+POINTS_KEYS = ("points", "total_points")
+POINTS_CONFIG_KEYS = ("fw", "s", "fr", "ba", "ov")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS derived (
+    layer TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (layer, key)
+);
+CREATE INDEX IF NOT EXISTS derived_used ON derived (used);
+"""
+
+
+def round_key(round):
+    """ Hash of what the scoring layer depends on, a round's teams and scores (in their order) """
+    payload = json.dumps([round["teams"], round["scores"]], separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def points_key(scoring_key, points_config):
+    """ Hash of what the points layer depends on, the scoring layer and the point values """
+    payload = json.dumps([scoring_key] + [points_config[key] for key in POINTS_CONFIG_KEYS])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class DerivedCache(object):
+    """
+    SQLite memo of results derived from single rounds, kept across runs.
+
+    Values are stored per layer under a hash of exactly what they depend on: the scoring layer
+    (teams and nassau results, flight winners, flight splits and skins) under round_key(), the points
+    layer under points_key(). Changing the points configuration therefore only misses the points
+    layer, validity (blacklist, season dates, min_players) is cheap and never cached. Least
+    recently used entries are evicted once the stored values exceed max_bytes.
+
+    Reads are immediate, writes and last-use times are batched until flush().
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Also used from the bbc-stats serve refresh thread, never concurrently
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        with self.connection:
+            if version not in (0, DERIVED_VERSION):
+                print("Discarding derived results cache %s with version %d" % (path, version))
+                self.connection.execute("DROP TABLE IF EXISTS derived")
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("PRAGMA user_version = %d" % DERIVED_VERSION)
+        self.pending = {}
+        self.used = set()
+        # Rounds whose scoring was read from, or computed and added to, the cache
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.connection.close()
+
+    def contains(self, layer, key):
+        return (layer, key) in self.pending or self.connection.execute(
+            "SELECT 1 FROM derived WHERE layer = ? AND key = ?", (layer, key)).fetchone() is not None
+
+    def get(self, layer, key):
+        """ :return: The stored value, None on a miss """
+        if (layer, key) in self.pending:
+            return pickle.loads(self.pending[layer, key])
+        row = self.connection.execute("SELECT value FROM derived WHERE layer = ? AND key = ?",
+                                      (layer, key)).fetchone()
+        if row is None:
+            return None
+        self.used.add((layer, key))
+        return pickle.loads(row[0])
+
+    def put(self, layer, key, value):
+        self.pending[layer, key] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def flush(self):
+        """ Writes pending values and last-use times, then evicts down to max_bytes """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO derived (layer, key, value, size, used) VALUES (?, ?, ?, ?, ?)",
+                [(layer, key, value, len(value), now) for (layer, key), value in self.pending.items()])
+            self.connection.executemany("UPDATE derived SET used = ? WHERE layer = ? AND key = ?",
+                                        [(now, layer, key) for layer, key in self.used])
+            self.evict()
+        self.pending = {}
+        self.used = set()
+
+    def evict(self):
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM derived").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        evicted = []
+        for layer, key, size in self.connection.execute("SELECT layer, key, size FROM derived ORDER BY used"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((layer, key))
+            total -= size
+        self.connection.executemany("DELETE FROM derived WHERE layer = ? AND key = ?", evicted)
+        return len(evicted)
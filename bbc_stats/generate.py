@@ -1,19 +1,20 @@
 """
 This script is used to compute the PowerRankings and produce an excel file along with printing to the screen.
 """
-from golfgenius.stats import Stats
-from bbc_stats.collection import RoundsCollection, PlayersCollection
-from bbc_stats.data import GithubData
+from bbc_stats.store import ResultsStore, default_year as store_default_year
+from bbc_stats.options import METRICS, parse_windows, window_label, parse_weight_values
+from bbc_stats import profiling
+from bbc_stats import serializers
 import json
 import datetime
-from collections import defaultdict
+import itertools
 from operator import itemgetter
-import numpy as np
 import re
-from terminaltables import SingleTable
-import xlsxwriter
 import os
 
+# numpy (through the collections and rankings), xlsxwriter, terminaltables and golfgenius are imported
+# where they are used, so --help and short runs do not pay for loading them
+
 
 def json_default_encoder(obj):
     if isinstance(obj, datetime.date):
@@ -21,15 +22,34 @@ def json_default_encoder(obj):
     raise TypeError("Unable to encode %r" % obj)
 
 
-def parse_args():
+def parse_args(argv=None):
     import argparse
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
+    parser.add_argument('command', nargs='?', choices=['serve', 'sweep'],
+                        help="serve: keep the results in memory and answer JSON queries over HTTP. "
+                             "sweep: compare the points standings of every variant in --sweep-file.")
     parser.add_argument('--results-directory', default='./results', type=str, metavar='<PATH>',
                         help="Path to results directory")
+    parser.add_argument('--no-results-cache', action='store_true',
+                        help="Do not use the parsed results cache stored in the results directory.")
+    parser.add_argument('--results-cache-hash', action='store_true',
+                        help="Also verify the content hash of cached results files, not just mtime and size.")
+    parser.add_argument('--derived-cache-size', default=64, type=int, metavar='<MB>',
+                        help="Size bound of the cache of scored rounds in the results directory, 0 disables it.")
+    parser.add_argument('--results-database', metavar='<PATH>',
+                        help="Read rounds from this SQLite results database instead of the results directory.")
+    parser.add_argument('--import-results', action='store_true',
+                        help="Import the results directory into --results-database before computing.")
     parser.add_argument('--weeks', type=int, metavar='<integer>',
                         help="Data range in weeks. If not set all rounds are selected.")
+    parser.add_argument('--season', type=int, metavar='<year>',
+                        help="Only open the results partition of this season (and unpartitioned results). "
+                             "Also the year of unpartitioned rounds without season metadata.")
+    parser.add_argument('--windows', type=parse_windows, metavar='<windows>',
+                        help="Comma separated ranking windows in weeks and/or 'season', e.g. 4,8,12,season. "
+                             "Renders power rankings per window and writes them to a JSON file.")
     parser.add_argument('--min-rounds', default=0, type=int, metavar='<integer>',
                         help="Minimum number of rounds for player to count in rankings")
     parser.add_argument('--weighted-rounds', default=2, type=int, metavar='<integer>',
@@ -42,14 +62,41 @@ def parse_args():
                         help="Relative weight to apply to scoring average.")
     parser.add_argument('--weight-pars', type=float, default=2, metavar='<float>',
                         help="Relative weight to apply to pars per round_info average.")
+    parser.add_argument('--weight-grid', nargs=3, type=parse_weight_values,
+                        metavar=('<scoring>', '<birdies>', '<pars>'),
+                        help="Comma separated weights per metric, e.g. 2,4,6 3,5 1,2. Reports how stable the power "
+                             "rankings are over every weight combination.")
     parser.add_argument('--dump', action='store_true',
                         help="Dump player data as JSON")
+    parser.add_argument('--no-excel', action='store_true',
+                        help="Only print the tables, do not write the PowerRankings excel workbook.")
     parser.add_argument('--summary', action='store_true',
                         help="Print data summary before power rankings")
     parser.add_argument('--player-filter', type=re.compile, default='.*', metavar='<regex>',
                         help="Show data for player names that match filter")
     parser.add_argument('--github-site', metavar='<PATH>',
                         help="Path to root github site. If set, data will be updated.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only rewrite github site files whose content changed and remove stale ones.")
+    parser.add_argument('--watch', action='store_true',
+                        help="Stay resident and recompute the outputs affected by changed round files.")
+    parser.add_argument('--watch-interval', default=2.0, type=float, metavar='<seconds>',
+                        help="How often --watch and serve poll the results directory.")
+    parser.add_argument('--sweep-file', metavar='<PATH>',
+                        help="JSON list of points config overrides, or a grid of values for every key, for sweep.")
+    parser.add_argument('--sweep-output', metavar='<PATH>', help="Also write the sweep standings as JSON.")
+    parser.add_argument('--host', default='127.0.0.1', metavar='<host>', help="Address serve listens on.")
+    parser.add_argument('--port', default=8000, type=int, metavar='<integer>', help="Port serve listens on.")
+    parser.add_argument('--jobs', default=1, type=int, metavar='<integer>',
+                        help="Number of processes used to parse rounds.")
+    parser.add_argument('--profile', metavar='<PATH>',
+                        help="Record per-stage wall time and call counts and write them as JSON to this file.")
+    parser.add_argument('--profile-stats', metavar='<PATH>',
+                        help="Also profile the run with cProfile and write the pstats file here.")
+    parser.add_argument('--yaml-backend', default='auto', choices=serializers.YAML_BACKENDS,
+                        help="YAML serializer for github site collections, auto prefers libyaml.")
+    parser.add_argument('--json-backend', default='auto', choices=serializers.JSON_BACKENDS,
+                        help="JSON serializer for github site data files, auto prefers ujson when installed.")
     parser.add_argument('--points-config-file', metavar='<PATH>',
                         help="Path to a JSON file containing points configuration.")
     parser.add_argument('--blacklist-rounds-file', metavar='<PATH>',
@@ -64,124 +111,154 @@ def parse_args():
                         help="Point value for winning overall nassau bet.")
     parser.add_argument('--max-rounds-per-month', default=4, type=int,
                         help="Max rounds that count towards points each month.")
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    # Weights are never negative, so only the all-zero setting sums to 0 and has no power ranking
+    if args.weight_grid and all(0 in weights for weights in args.weight_grid):
+        parser.error("--weight-grid contains the setting 0,0,0 (scoring, birdies, pars) whose weights sum to 0, "
+                     "remove 0 from at least one metric")
+    return args
 
 
 class PowerRankings(object):
-    def __init__(self, results_dir, timedelta=None, weighted_rounds=None, rankings_weights=[1, 1, 1], min_rounds=0):
+    def __init__(self, results_store, timedelta=None, weighted_rounds=None, rankings_weights=[1, 1, 1], min_rounds=0):
         """
+        Player scores come from golfgenius Stats, which re-reads the store's round files from
+        stats_directory(). With a timedelta, the unbounded all_stats needed by windows and the
+        rankings history is a second Stats read of the same files.
 
-        :param results_dir: Path to results directory
+        :param results_store: ResultsStore (or path to results directory)
         :param timedelta: Datetime.timedelta range to limit data
         :param weighted_rounds: How many recent rounds to weight
         :param rankings_weights: Tuple (Scoring, Birdies, Pars)
         :param min_rounds: Minimum number of rounds for player to count in bbc_stats
         """
-        self.stats = Stats(results_dir, timedelta=timedelta)
-        self.raw_data = self.stats.player_scores()
-        self.all_stats = Stats(results_dir, timedelta=None)
+        from golfgenius.stats import Stats
+        if not isinstance(results_store, ResultsStore):
+            results_store = ResultsStore(results_store)
+        self.store = results_store
+        self.timedelta = timedelta
+        with profiling.stage("rankings.stats"):
+            self.stats = Stats(self.store.stats_directory(), timedelta=timedelta)
+            self.raw_data = self.stats.player_scores()
+        self._all_stats = None
         self.weighted_rounds = weighted_rounds
         self.rankings_weights = [float(x) for x in rankings_weights]
         self.min_rounds = min_rounds
+        self._table = None
+        self._windowed = None
+        self._all_raw_data = None
+
+    @property
+    def all_stats(self):
+        # Only load the unbounded Stats object when something asks for it
+        if self._all_stats is None:
+            if self.timedelta is None:
+                self._all_stats = self.stats
+            else:
+                from golfgenius.stats import Stats
+                with profiling.stage("rankings.all_stats"):
+                    self._all_stats = Stats(self.store.stats_directory(), timedelta=None)
+        return self._all_stats
 
     def all_players(self):
         return sorted(self.raw_data.keys())
 
-    def _average_weighted(self, scores):
-        weight = 1
-        if self.weighted_rounds is None:
-            weights = [weight for _ in range(len(scores))]
-        else:
-            weighted_rounds = int(self.weighted_rounds) if len(scores) >= self.weighted_rounds else len(scores)
-            weights = [weight for _ in range(max(0, len(scores) - weighted_rounds))]
-            for _ in range(weighted_rounds):
-                weight = weight + 1
-                weights.append(weight)
-                weight = weight * weight
-        if not scores:
-            return 0.0, 0.0
-        return np.average(scores), np.average(scores, weights=weights)
+    @property
+    def table(self):
+        # Player series are extracted from raw_data once and shared by every ranking
+        if self._table is None:
+            from bbc_stats.rankings import RankingsTable
+            with profiling.stage("rankings.table"):
+                self._table = RankingsTable(self.raw_data, weighted_rounds=self.weighted_rounds,
+                                            min_rounds=self.min_rounds)
+        return self._table
+
+    @property
+    def all_raw_data(self):
+        # Player scores over every round, shared by the windows and the history
+        if self._all_raw_data is None:
+            self._all_raw_data = self.all_stats.player_scores() if self.timedelta is not None else self.raw_data
+        return self._all_raw_data
+
+    @property
+    def windowed(self):
+        if self._windowed is None:
+            from bbc_stats.rankings import WindowedRankings
+            with profiling.stage("rankings.windows"):
+                self._windowed = WindowedRankings(self.all_raw_data, weighted_rounds=self.weighted_rounds,
+                                                  min_rounds=self.min_rounds)
+        return self._windowed
+
+    def history(self):
+        """ Power rankings after every round date, see rankings.RankingsHistory """
+        from bbc_stats.rankings import RankingsHistory
+        return RankingsHistory(self.all_raw_data, weighted_rounds=self.weighted_rounds, min_rounds=self.min_rounds)
+
+    @profiling.timed("rankings.weight_sensitivity")
+    def weight_sensitivity(self, weight_grid):
+        """ Power rankings under every combination of the (scoring, birdies, pars) weight lists """
+        from bbc_stats.rankings import WeightSensitivity
+        return WeightSensitivity(self.table, list(itertools.product(*weight_grid)), self.rankings_weights)
 
     def scoring_averages(self):
-        averages = []
-        for player in self.all_players():
-            rounds = len(self.raw_data[player])
-            if rounds < self.min_rounds:
-                continue
-            scores = [round["score"] for round in self.raw_data[player]]
-            average, weighted = self._average_weighted(scores)
-            averages.append((player, average, weighted))
-        return sorted(averages, key=itemgetter(2))
+        return self.table.averages_list("scoring")
 
     def birdies_or_better_averages(self):
-        averages = []
-        for player in self.all_players():
-            rounds = len(self.raw_data[player])
-            if rounds < self.min_rounds:
-                continue
-            scores = [len(round["eagles"]) + len(round["birdies"]) for round in self.raw_data[player]]
-            average, weighted = self._average_weighted(scores)
-            averages.append((player, average, weighted))
-        return sorted(averages, key=itemgetter(2), reverse=True)
+        return self.table.averages_list("birdies")
 
     def par_averages(self):
-        averages = []
-        for player in self.all_players():
-            rounds = len(self.raw_data[player])
-            if rounds < self.min_rounds:
-                continue
-            scores = [len(round["pars"]) for round in self.raw_data[player]]
-            average, weighted = self._average_weighted(scores)
-            averages.append((player, average, weighted))
-        return sorted(averages, key=itemgetter(2), reverse=True)
+        return self.table.averages_list("pars")
 
+    @profiling.timed("rankings.power_rankings")
     def power_rankings(self):
-        rankings = defaultdict(dict)
-        scoring_averages = self.scoring_averages()
-        birdie_averages = self.birdies_or_better_averages()
-        par_averages = self.par_averages()
-        _all_data = {
-            "scoring": [],
-            "birdies": [],
-            "pars": []
-        }
-        for player in self.all_players():
-            rounds = len(self.raw_data[player])
-            if rounds < self.min_rounds:
-                continue
-            rankings[player]["player"] = player
-            rankings[player]["rounds"] = rounds
-            for idx, item in enumerate(scoring_averages):
-                if item[0] == player:
-                    avg, avg_weighted = item[1], item[2]
-                    rankings[player]["scoring"] = (idx + 1, avg, avg_weighted)
-                    _all_data["scoring"].append(avg_weighted)
-            for idx, item in enumerate(birdie_averages):
-                if item[0] == player:
-                    avg, avg_weighted = item[1], item[2]
-                    rankings[player]["birdies"] = (idx + 1, avg, avg_weighted)
-                    _all_data["birdies"].append(avg_weighted)
-            for idx, item in enumerate(par_averages):
-                if item[0] == player:
-                    avg, avg_weighted = item[1], item[2]
-                    rankings[player]["pars"] = (idx + 1, avg, avg_weighted)
-                    _all_data["pars"].append(avg_weighted)
-        _all_data["scoring"] = sorted(_all_data["scoring"])
-        _all_data["birdies"] = sorted(_all_data["birdies"], reverse=True)
-        _all_data["pars"] = sorted(_all_data["pars"], reverse=True)
-        for player in rankings.keys():
-            _scoring_avg, _scoring_weighted = rankings[player]["scoring"][1], rankings[player]["scoring"][2]
-            _birdies_avg, _birdies_weighted = rankings[player]["birdies"][1], rankings[player]["birdies"][2]
-            _pars_avg, _pars_weighted = rankings[player]["pars"][1], rankings[player]["pars"][2]
-            _scoring_rank = _all_data["scoring"].index(_scoring_weighted) + 1
-            _birdies_rank = _all_data["birdies"].index(_birdies_weighted) + 1
-            _pars_rank = _all_data["pars"].index(_pars_weighted) + 1
-            rankings[player]["scoring"] = _scoring_rank, _scoring_avg, _scoring_weighted
-            rankings[player]["birdies"] = _birdies_rank, _birdies_avg, _birdies_weighted
-            rankings[player]["pars"] = _pars_rank, _pars_avg, _pars_weighted
-            _data = [_scoring_rank, _birdies_rank, _pars_rank]
-            rankings[player]["power_ranking"] = 100 / np.average(_data, weights=self.rankings_weights)
-        return sorted(rankings.values(), key=itemgetter("power_ranking"), reverse=True)
+        return power_rankings_list(self.table, self.rankings_weights)
+
+    @profiling.timed("rankings.window_power_rankings")
+    def window_power_rankings(self, window):
+        """ Power rankings over one window, see rankings.WindowedRankings """
+        return power_rankings_list(self.windowed.table(window), self.rankings_weights)
+
+
+def power_rankings_list(table, rankings_weights):
+    """ Power ranking dicts for every player of a RankingsTable, best first """
+    ranks, power_rankings = table.power_rankings(rankings_weights)
+    rankings = []
+    for idx, player in enumerate(table.players):
+        ranking = {"player": player, "rounds": int(table.rounds[idx])}
+        for metric_idx, metric in enumerate(METRICS):
+            ranking[metric] = (int(ranks[metric_idx, idx]), table.averages[metric_idx, idx],
+                               table.weighted[metric_idx, idx])
+        ranking["power_ranking"] = power_rankings[idx]
+        rankings.append(ranking)
+    return sorted(rankings, key=itemgetter("power_ranking"), reverse=True)
+
+
+# Per-column (converter, worksheet writer) for RenderOutput.render_table
+COLUMN_WRITERS = {
+    "int": (int, "write_number"),
+    "float": (float, "write_number"),
+    "number": (lambda d: d, "write_number"),
+    "string": (str, "write_string")
+}
+
+
+def average_trend(average, average_weighted):
+    if average_weighted == average:
+        trend = '0'
+    elif average_weighted > average:
+        trend = '%.3f' % (average_weighted - average)
+    else:
+        trend = '-%.3f' % (average - average_weighted)
+    return float(trend)
+
+
+def power_ranking_trend(average, average_weighted):
+    if average_weighted == average:
+        return '+-0'
+    elif average_weighted > average:
+        return '+%.3f' % (average_weighted - average)
+    else:
+        return '-%.3f' % (average - average_weighted)
 
 
 class RenderOutput(object):
@@ -189,227 +266,154 @@ class RenderOutput(object):
         self.args = parser_args
         self.pr = power_rankings_object
         today = datetime.datetime.today()
-        self.excel = xlsxwriter.Workbook("PowerRankings-{month}-{day}-{year}.xlsx".format(
-                month=today.month, day=today.day, year=today.year))
+        self.output_name = "PowerRankings-{month}-{day}-{year}".format(
+                month=today.month, day=today.day, year=today.year)
+        self.excel = None
+        if not self.args.no_excel:
+            import xlsxwriter
+            # constant_memory flushes every row as it is written instead of holding the workbook
+            self.excel = xlsxwriter.Workbook(self.output_name + ".xlsx", {"constant_memory": True})
+
+    def render_table(self, title, header, col_types, rows):
+        """
+        Prints rows as a terminal table and writes the same rows to a worksheet named title (unless --no-excel).
 
+        :param col_types: One COLUMN_WRITERS key per column
+        :param rows: Iterable of row tuples
+        """
+        from terminaltables import SingleTable
+        rows = list(rows)
+        print(SingleTable([header] + rows, title=title).table)
+        if self.excel is None:
+            return
+        sheet = self.excel.add_worksheet(title)
+        sheet.write_row(0, 0, header)
+        writers = [(COLUMN_WRITERS[col_type][0], getattr(sheet, COLUMN_WRITERS[col_type][1]))
+                   for col_type in col_types]
+        for row, row_data in enumerate(rows, 1):
+            for col, (col_data, (convert, write)) in enumerate(zip(row_data, writers)):
+                try:
+                    write(row, col, convert(col_data))
+                except:
+                    print("SHEET", title, "ROW", row, "COL", col, "DATA", col_data, "TYPE", type(col_data))
+                    raise
+
+    def averages_rows(self, averages):
+        for idx, item in enumerate(averages):
+            player, average, average_weighted = item
+            if re.search(self.args.player_filter, player):
+                trend = average_trend(average, average_weighted)
+                yield idx + 1, player, "%.3f" % average, "%.3f" % trend
+
+    def power_rankings_rows(self, power_rankings):
+        for idx, item in enumerate(power_rankings):
+            if re.search(self.args.player_filter, item["player"]):
+                metrics = []
+                for metric in METRICS:
+                    _, avg, avg_weighted = item[metric]
+                    trend = power_ranking_trend(avg, avg_weighted)
+                    metrics.append("%.3f (%s)" % (avg_weighted, trend) if trend != '+-0' else "%.3f" % avg_weighted)
+                yield (idx + 1, item["player"], "%.3f" % item["power_ranking"]) + tuple(metrics) + (
+                    "%s" % item["rounds"],)
+
+    @profiling.timed("render.player_count")
     def render_player_count(self):
+        from terminaltables import SingleTable
         # Player Count Table
         print(SingleTable([["Players"], [len(self.pr.all_players())]], title="Total Players").table)
+        if self.excel is None:
+            return
         worksheet = self.excel.add_worksheet("Total Players")
         worksheet.write(0, 0, "Players")
         worksheet.write_number(0, 1, len(self.pr.all_players()))
 
+    @profiling.timed("render.round_count")
     def render_round_count(self):
         # Round Count Table
-        round_count_data = [["Rank", "Player", "Rounds"]]
         round_counts = {k: len(v) for k, v in self.pr.raw_data.items()}
-        for idx, item in enumerate(sorted(round_counts.items(), key=itemgetter(1), reverse=True)):
-            player, rounds = item
-            if re.search(self.args.player_filter, player):
-                round_count_data.append([idx + 1, player, rounds])
-        round_count_table = SingleTable(round_count_data, title="Round Counts")
-        print(round_count_table.table)
-        col_types = ['number', 'string', 'number']
-        sheet = self.excel.add_worksheet("Round Counts")
-        row, col = 0, 0
-        for header in round_count_data[0]:
-            sheet.write(0, col, header)
-            col += 1
-        row, col = 1, 0
-        for row_data in round_count_data[1:]:
-            for col_data in row_data:
-                getattr(sheet, "write_{}".format(col_types[col]))(row, col, col_data)
-                col += 1
-            row += 1
-            col = 0
+        rows = ((idx + 1, player, rounds)
+                for idx, (player, rounds) in enumerate(sorted(round_counts.items(), key=itemgetter(1), reverse=True))
+                if re.search(self.args.player_filter, player))
+        self.render_table("Round Counts", ["Rank", "Player", "Rounds"], ['number', 'string', 'number'], rows)
 
+    @profiling.timed("render.scoring_averages")
     def render_scoring_averages(self):
         # Scoring Average Table
-        scoring_averages_data = [["Rank", "Player", "Average", "Trend"]]
-        for idx, item in enumerate(self.pr.scoring_averages()):
-            player, average, average_weighted = item
-            if re.search(self.args.player_filter, player):
-                if average_weighted == average:
-                    trend = '0'
-                elif average_weighted > average:
-                    trend = '%.3f' % (average_weighted - average)
-                else:
-                    trend = '-%.3f' % (average - average_weighted)
-                trend = float(trend)
-                scoring_averages_data.append((idx + 1, player, "%.3f" % average, "%.3f" % trend))
-        scoring_averages_table = SingleTable(scoring_averages_data,
-                                             title="Scoring Average")
-        print(scoring_averages_table.table)
-        sheet = self.excel.add_worksheet("Scoring Average")
-        col_types = ['int', 'string', 'float', 'float']
-        row, col = 0, 0
-        for header in scoring_averages_data[0]:
-            sheet.write(row, col, header)
-            col += 1
-        row, col = 1, 0
-        for row_data in scoring_averages_data[1:]:
-            for col_data in row_data:
-                try:
-                    col_type, col_writer = {
-                        "int": (lambda d: int(d), 'number'),
-                        "float": (lambda d: float(d), 'number'),
-                        "string": (lambda d: str(d), 'string')
-                    }[col_types[col]]
-                    col_data = col_type(col_data)
-                    getattr(sheet, "write_{}".format(col_writer))(row, col, col_data)
-                except:
-                    print("SHEET", "Scoring Average", "ROW", row, "COL", col, "DATA", col_data, "TYPE", type(col_data))
-                    raise
-                col += 1
-            row += 1
-            col = 0
+        self.render_table("Scoring Average", ["Rank", "Player", "Average", "Trend"],
+                          ['int', 'string', 'float', 'float'], self.averages_rows(self.pr.scoring_averages()))
 
+    @profiling.timed("render.birdies_averages")
     def render_birdies_averages(self):
         # Birdies Per Round Table
-        birdies_averages_data = [["Rank", "Player", "Average", "Trend"]]
-        for idx, item in enumerate(self.pr.birdies_or_better_averages()):
-            player, average, average_weighted = item
-            if re.search(self.args.player_filter, player):
-                if average_weighted == average:
-                    trend = '0'
-                elif average_weighted > average:
-                    trend = '%.3f' % (average_weighted - average)
-                else:
-                    trend = '-%.3f' % (average - average_weighted)
-                trend = float(trend)
-                birdies_averages_data.append((idx + 1, player, "%.3f" % average, "%.3f" % trend))
-        birdies_averages_table = SingleTable(birdies_averages_data,
-                                             title="Birdies per Round Average")
-        print(birdies_averages_table.table)
-        sheet = self.excel.add_worksheet("Birdies per Round Average")
-        col_types = ['int', 'string', 'float', 'float']
-        row, col = 0, 0
-        for header in birdies_averages_data[0]:
-            sheet.write(row, col, header)
-            col += 1
-        row, col = 1, 0
-        for row_data in birdies_averages_data[1:]:
-            for col_data in row_data:
-                try:
-                    col_type, col_writer = {
-                        "int": (lambda d: int(d), 'number'),
-                        "float": (lambda d: float(d), 'number'),
-                        "string": (lambda d: str(d), 'string')
-                    }[col_types[col]]
-                    col_data = col_type(col_data)
-                    getattr(sheet, "write_{}".format(col_writer))(row, col, col_data)
-                except:
-                    print("SHEET", "Birdies per Round Average", "ROW", row, "COL", col, "DATA", col_data, "TYPE", type(col_data))
-                    raise
-                col += 1
-            row += 1
-            col = 0
+        self.render_table("Birdies per Round Average", ["Rank", "Player", "Average", "Trend"],
+                          ['int', 'string', 'float', 'float'],
+                          self.averages_rows(self.pr.birdies_or_better_averages()))
 
+    @profiling.timed("render.pars_averages")
     def render_pars_averages(self):
         # Pars Per Round Table
-        pars_averages_data = [["Rank", "Player", "Average", "Trend"]]
-        for idx, item in enumerate(self.pr.par_averages()):
-            player, average, average_weighted = item
-            if re.search(self.args.player_filter, player):
-                if average_weighted == average:
-                    trend = '0'
-                elif average_weighted > average:
-                    trend = '%.3f' % (average_weighted - average)
-                else:
-                    trend = '-%.3f' % (average - average_weighted)
-                trend = float(trend)
-                pars_averages_data.append((idx + 1, player, "%.3f" % average, "%.3f" % trend))
-        pars_averages_table = SingleTable(pars_averages_data,
-                                          title="Pars per Round Average")
-        print(pars_averages_table.table)
-        col_types = ['int', 'string', 'float', 'float']
-        sheet = self.excel.add_worksheet("Pars per Round Average")
-        row, col = 0, 0
-        for header in pars_averages_data[0]:
-            sheet.write(row, col, header)
-            col += 1
-        row, col = 1, 0
-        for row_data in pars_averages_data[1:]:
-            for col_data in row_data:
-                try:
-                    col_type, col_writer = {
-                        "int": (lambda d: int(d), 'number'),
-                        "float": (lambda d: float(d), 'number'),
-                        "string": (lambda d: str(d), 'string')
-                    }[col_types[col]]
-                    col_data = col_type(col_data)
-                    getattr(sheet, "write_{}".format(col_writer))(row, col, col_data)
-                except:
-                    print("SHEET", "Pars per Round Average", "ROW", row, "COL", col, "DATA", col_data, "TYPE", type(col_data))
-                    raise
-                col += 1
-            row += 1
-            col = 0
+        self.render_table("Pars per Round Average", ["Rank", "Player", "Average", "Trend"],
+                          ['int', 'string', 'float', 'float'], self.averages_rows(self.pr.par_averages()))
 
+    @profiling.timed("render.power_rankings")
     def render_power_rankings(self):
         # Power Rankings Table
-        power_rankings_data = [["Rank", "Player", "Power Ranking", "Scoring",
-                                "Birdies or Better", "Pars", "Rounds"]]
-        for idx, item in enumerate(self.pr.power_rankings()):
-            if re.search(self.args.player_filter, item["player"]):
-                power_ranking = item["power_ranking"]
-                scoring_idx, scoring_avg, scoring_avg_weighted = item["scoring"]
-                if scoring_avg_weighted == scoring_avg:
-                    scoring_trend = '+-0'
-                elif scoring_avg_weighted > scoring_avg:
-                    scoring_trend = '+%.3f' % (scoring_avg_weighted - scoring_avg)
-                else:
-                    scoring_trend = '-%.3f' % (scoring_avg - scoring_avg_weighted)
-                birdies_idx, birdies_avg, birdies_avg_weighted = item["birdies"]
-                if birdies_avg_weighted == birdies_avg:
-                    birdies_trend = '+-0'
-                elif birdies_avg_weighted > birdies_avg:
-                    birdies_trend = '+%.3f' % (birdies_avg_weighted - birdies_avg)
-                else:
-                    birdies_trend = '-%.3f' % (birdies_avg - birdies_avg_weighted)
-                pars_idx, pars_avg, pars_avg_weighted = item["pars"]
-                if pars_avg_weighted == pars_avg:
-                    pars_trend = '+-0'
-                elif pars_avg_weighted > pars_avg:
-                    pars_trend = '+%.3f' % (pars_avg_weighted - pars_avg)
-                else:
-                    pars_trend = '-%.3f' % (pars_avg - pars_avg_weighted)
-                power_rankings_data.append((idx + 1, item["player"], "%.3f" % item["power_ranking"],
-                                            "%.3f (%s)" % (scoring_avg_weighted, scoring_trend) if scoring_trend != '+-0' else "%.3f" % scoring_avg_weighted,
-                                            "%.3f (%s)" % (birdies_avg_weighted, birdies_trend) if birdies_trend != '+-0' else "%.3f" % birdies_avg_weighted,
-                                            "%.3f (%s)" % (pars_avg_weighted, pars_trend) if pars_trend != '+-0' else "%.3f" % pars_avg_weighted,
-                                            "%s" % item["rounds"]))
-        power_rankings_table = SingleTable(power_rankings_data,
-                                           title="Power Rankings")
-        print(power_rankings_table.table)
+        self.render_table("Power Rankings", ["Rank", "Player", "Power Ranking", "Scoring",
+                                             "Birdies or Better", "Pars", "Rounds"],
+                          ['int', 'string', 'float', 'string', 'string', 'string', 'int'],
+                          self.power_rankings_rows(self.pr.power_rankings()))
+
+    @profiling.timed("render.windows")
+    def render_windows(self, windows):
+        # Power Rankings Table per window, also written to <output name>.json
+        header = ["Rank", "Player", "Power Ranking", "Scoring", "Birdies or Better", "Pars", "Rounds"]
         col_types = ['int', 'string', 'float', 'string', 'string', 'string', 'int']
-        sheet = self.excel.add_worksheet("Power Rankings")
-        row, col = 0, 0
-        for header in power_rankings_data[0]:
-            sheet.write(row, col, header)
-            col += 1
-        row, col = 1, 0
-        for row_data in power_rankings_data[1:]:
-            for col_data in row_data:
-                try:
-                    col_type, col_writer = {
-                        "int": (lambda d: int(d), 'number'),
-                        "float": (lambda d: float(d), 'number'),
-                        "string": (lambda d: str(d), 'string')
-                    }[col_types[col]]
-                    col_data = col_type(col_data)
-                    getattr(sheet, "write_{}".format(col_writer))(row, col, col_data)
-                except:
-                    print("SHEET", "Power Rankings", "ROW", row, "COL", col, "DATA", col_data, "TYPE", type(col_data))
-                    raise
-                col += 1
-            row += 1
-            col = 0
+        data = []
+        for window in windows:
+            power_rankings = self.pr.window_power_rankings(window)
+            self.render_table("Power Rankings (%s)" % window_label(window), header, col_types,
+                              self.power_rankings_rows(power_rankings))
+            rankings = []
+            for idx, item in enumerate(power_rankings):
+                if re.search(self.args.player_filter, item["player"]):
+                    ranking = {"rank": idx + 1, "player": item["player"], "power_ranking": item["power_ranking"],
+                               "rounds": item["rounds"]}
+                    for metric in METRICS:
+                        rank, average, average_weighted = item[metric]
+                        ranking[metric] = {"rank": rank, "average": average, "weighted": average_weighted}
+                    rankings.append(ranking)
+            data.append({"window": window_label(window), "start": str(self.pr.windowed.start_date(window)),
+                         "rankings": rankings})
+        with open(self.output_name + ".json", "w") as fp:
+            fp.write(serializers.dump_json({"windows": data}, indent=4, sort_keys=True))
 
+    @profiling.timed("render.weight_sensitivity")
+    def render_weight_sensitivity(self, weight_grid):
+        # Position spread per player over the grid, the whole matrix is written to <output name>-weights.json
+        sensitivity = self.pr.weight_sensitivity(weight_grid)
+        stability = [item for item in sensitivity.stability() if re.search(self.args.player_filter, item["player"])]
+        self.render_table("Weight Sensitivity",
+                          ["Rank", "Player", "Best", "Worst", "Mean", "Std", "Changed"],
+                          ['int', 'string', 'int', 'int', 'string', 'string', 'string'],
+                          [(item["position"], item["player"], item["best"], item["worst"], "%.2f" % item["mean"],
+                            "%.2f" % item["std"], "%.0f%%" % (100 * item["changed"])) for item in stability])
+        print("The leader changes in %d of %d weight settings" % (sensitivity.leader_changes(),
+                                                                  len(sensitivity.weights)))
+        with open(self.output_name + "-weights.json", "w") as fp:
+            fp.write(serializers.dump_json({
+                "stability": stability,
+                "settings": [{"weights": weights.tolist(), "rankings": sensitivity.rankings(setting)}
+                             for setting, weights in enumerate(sensitivity.weights)]
+            }, indent=4))
+
+    @profiling.timed("render.excel_close")
     def close(self):
-        self.excel.close()
+        if self.excel is not None:
+            self.excel.close()
 
-    def update_github_site(self, results_directory, project_root_dir, points_config, blacklisted_rounds):
+    @profiling.timed("github_site")
+    def update_github_site(self, results_store, project_root_dir, points_config, blacklisted_rounds,
+                           incremental=False, jobs=1, rounds=None, players=None):
         """
         Updates collections:
             _rounds/<name>.md
@@ -418,22 +422,35 @@ class RenderOutput(object):
             players/<name>.json
             rounds/<name>.json
             rankings.json
+            rankings_history.json
 
 
-        :param results_directory: The path to the results directory
+        :param results_store: The ResultsStore holding the loaded rounds
         :param project_root_dir: The path to the root of the github pages repo
+        :param incremental: Only rewrite files whose content changed, remove files no longer produced
+        :param jobs: Number of processes used to parse rounds
+        :param rounds: RoundsCollection to export, e.g. one with rounds already parsed by the sync pipeline
+        :param players: PlayersCollection to export, e.g. one kept by --watch that only recomputes stale players
         :return:
         """
-        rounds = RoundsCollection(results_directory, points_config=points_config,
-                                  blacklisted_rounds=blacklisted_rounds)
-        rounds_data = rounds.export(project_root_dir)
-        players = PlayersCollection(results_directory, points_config=points_config,
-                                    blacklisted_rounds=blacklisted_rounds)
+        from terminaltables import SingleTable
+        from bbc_stats.collection import RoundsCollection, PlayersCollection
+        from bbc_stats.data import GithubData, GithubRankingsHistory
+        if rounds is None:
+            rounds = RoundsCollection(results_store, points_config=points_config,
+                                      blacklisted_rounds=blacklisted_rounds, jobs=jobs)
+        rounds_data = rounds.export(project_root_dir, incremental=incremental)
+        if players is None:
+            players = PlayersCollection(results_store, points_config=points_config,
+                                        blacklisted_rounds=blacklisted_rounds)
         players.add_rounds(rounds_data)
-        players_data = players.export(project_root_dir)
-        data = GithubData(results_directory, stats_obj=self.pr.stats)
+        players_data = players.export(project_root_dir, incremental=incremental)
+        data = GithubData(results_store, stats_obj=self.pr.stats)
         data.invalid_rounds = rounds.invalid_rounds
-        github_data = data.export(project_root_dir)
+        github_data = data.export(project_root_dir, incremental=incremental)
+        history = GithubRankingsHistory(results_store, history=self.pr.history(),
+                                        rankings_weights=self.pr.rankings_weights)
+        history.export(project_root_dir, incremental=incremental)
         points_data = [["Rank", "Points", "Player", "Rounds", "Flight Wins", "Skins", "Overall", "Front", "Back"]]
         for idx, player_data in enumerate(sorted(players_data.values(), key=itemgetter("points"), reverse=True)):
             points_data.append([
@@ -453,16 +470,98 @@ class RenderOutput(object):
 
 
 
-def main():
-    args = parse_args()
+def load_points_config(args):
+    if args.points_config_file:
+        with open(args.points_config_file, "r") as fp:
+            return json.load(fp)
+    return {
+        "fw": args.points_flight_winner,
+        "s": args.points_skin,
+        "fr": args.points_nassau_front,
+        "ba": args.points_nassau_back,
+        "ov": args.points_nassau_overall,
+        "max_rounds_per_month": args.max_rounds_per_month
+    }
+
+
+def load_blacklisted_rounds(args):
+    if args.blacklist_rounds_file:
+        with open(args.blacklist_rounds_file, "r") as fp:
+            return [r.strip() for r in fp.readlines() if r.strip()]
+    return []
+
+
+def rankings_only(args):
+    """ Whether the run only computes the power rankings, not points, windows or site data """
+    return args.command is None and not args.github_site and not args.windows
+
+
+def load_results_store(args):
+    """
+    ResultsStore, or a DatabaseStore reading --results-database.
+
+    When nothing but the power rankings is computed only the season partitions that overlap --season and
+    --weeks are opened. The site collections count points over every loaded round and an incremental export
+    removes the pages of rounds that are not loaded, so site, windows, serve and sweep runs always load every
+    partition.
+    """
+    start_date = end_date = None
+    if args.season is not None and rankings_only(args):
+        start_date, end_date = datetime.date(args.season, 1, 1), datetime.date(args.season, 12, 31)
+    if args.weeks is not None and rankings_only(args):
+        weeks_start = datetime.date.today() - datetime.timedelta(weeks=args.weeks)
+        start_date = max(start_date, weeks_start) if start_date is not None else weeks_start
+    default_year = store_default_year(args.season, load_points_config(args))
+    if args.results_database:
+        from bbc_stats.database import ResultsDatabase, DatabaseStore
+        database = ResultsDatabase(args.results_database)
+        if args.import_results:
+            database.import_store(ResultsStore(args.results_directory, cache=not args.no_results_cache,
+                                               verify_hash=args.results_cache_hash, default_year=default_year))
+        return DatabaseStore(database, start_date=start_date, end_date=end_date, default_year=default_year)
+    return ResultsStore(args.results_directory, cache=not args.no_results_cache, verify_hash=args.results_cache_hash,
+                        start_date=start_date, end_date=end_date, default_year=default_year)
+
+
+def load_derived_cache(args):
+    """ The DerivedCache of scored rounds in the results directory, None if disabled """
+    if args.no_results_cache or args.derived_cache_size <= 0 or not os.path.isdir(args.results_directory):
+        return None
+    from bbc_stats.derived import DerivedCache, DERIVED_FILENAME
+    return DerivedCache(os.path.join(args.results_directory, DERIVED_FILENAME),
+                        max_bytes=args.derived_cache_size * 1024 * 1024)
+
+
+def load_rounds_collection(args, results_store):
+    from bbc_stats.collection import RoundsCollection
+    return RoundsCollection(results_store, points_config=load_points_config(args),
+                            blacklisted_rounds=load_blacklisted_rounds(args), jobs=args.jobs,
+                            derived_cache=load_derived_cache(args))
+
+
+def load_power_rankings(args, results_store):
     if args.weeks is not None:
         timedelta = datetime.timedelta(weeks=args.weeks)
     else:
         timedelta = None
-    pr = PowerRankings(args.results_directory, timedelta=timedelta,
-                       weighted_rounds=args.weighted_rounds or None,
-                       rankings_weights=[args.weight_scoring, args.weight_birdies, args.weight_pars],
-                       min_rounds=args.min_rounds)
+    return PowerRankings(results_store, timedelta=timedelta,
+                         weighted_rounds=args.weighted_rounds or None,
+                         rankings_weights=[args.weight_scoring, args.weight_birdies, args.weight_pars],
+                         min_rounds=args.min_rounds)
+
+
+def run(args, results_store=None, rounds=None, players=None):
+    """
+    Computes and renders the power rankings and updates the github site.
+
+    :param args: Parsed bbc-stats arguments
+    :param results_store: An already loaded ResultsStore, loaded from args.results_directory if None
+    :param rounds: An already (partially) parsed RoundsCollection to export
+    :param players: PlayersCollection to export
+    """
+    if results_store is None:
+        results_store = load_results_store(args)
+    pr = load_power_rankings(args, results_store)
 
     out = RenderOutput(args, pr)
     if args.summary:
@@ -472,29 +571,38 @@ def main():
         out.render_birdies_averages()
         out.render_pars_averages()
     out.render_power_rankings()
+    if args.windows:
+        out.render_windows(args.windows)
+    if args.weight_grid:
+        out.render_weight_sensitivity(args.weight_grid)
     if args.dump:
         data = {}
-        for player, rounds in pr.raw_data.items():
+        for player, player_rounds in pr.raw_data.items():
             if re.search(args.player_filter, player):
-                data[player] = rounds
+                data[player] = player_rounds
         print(json.dumps(data, indent=4, default=str, sort_keys=True))
     out.close()
     if args.github_site:
-        if args.points_config_file:
-            with open(args.points_config_file, "r") as fp:
-                points_config = json.load(fp)
-        else:
-            points_config = {
-                "fw": args.points_flight_winner,
-                "s": args.points_skin,
-                "fr": args.points_nassau_front,
-                "ba": args.points_nassau_back,
-                "ov": args.points_nassau_overall,
-                "max_rounds_per_month": args.max_rounds_per_month
-            }
-        if args.blacklist_rounds_file:
-            with open(args.blacklist_rounds_file, "r") as fp:
-                blacklisted_rounds = [r.strip() for r in fp.readlines() if r.strip()]
-        else:
-            blacklisted_rounds = []
-        out.update_github_site(args.results_directory, args.github_site, points_config, blacklisted_rounds)
+        if rounds is None:
+            rounds = load_rounds_collection(args, results_store)
+        out.update_github_site(results_store, args.github_site, load_points_config(args),
+                               load_blacklisted_rounds(args), incremental=args.incremental, jobs=args.jobs,
+                               rounds=rounds, players=players)
+
+
+def main():
+    args = parse_args()
+    if args.profile or args.profile_stats:
+        profiling.start("bbc-stats", timings_path=args.profile, pstats_path=args.profile_stats)
+    serializers.select(args.yaml_backend, args.json_backend)
+    if args.command == "sweep":
+        from bbc_stats.sweep import run_sweep
+        run_sweep(args)
+    elif args.command == "serve":
+        from bbc_stats.server import ResultsServer
+        ResultsServer(args).serve()
+    elif args.watch:
+        from bbc_stats.watch import ResultsWatcher
+        ResultsWatcher(args).watch()
+    else:
+        run(args)
@@ -0,0 +1,36 @@
+"""
+Values of bbc-stats options that rankings also uses, kept free of numpy so parsing arguments
+(and --help) does not load it.
+"""
+
+METRICS = ("scoring", "birdies", "pars")
+SEASON = "season"
+
+
+def parse_windows(value):
+    """ Parses a window list such as "4,8,12,season" into [4, 8, 12, "season"] """
+    windows = []
+    for window in value.split(","):
+        window = window.strip().lower()
+        if window == SEASON:
+            windows.append(SEASON)
+        elif window.isdigit() and int(window) > 0:
+            windows.append(int(window))
+        else:
+            raise ValueError("Unknown window %r, expected a number of weeks or %s" % (window, SEASON))
+    return windows
+
+
+def window_label(window):
+    return SEASON if window == SEASON else "%d weeks" % window
+
+
+def parse_weight_values(value):
+    """ Parses a comma separated weight list such as "2,4,6" for one metric of --weight-grid """
+    try:
+        weights = [float(weight) for weight in value.split(",")]
+    except ValueError:
+        raise ValueError("Unknown weights %r, expected comma separated numbers" % value)
+    if any(weight < 0 for weight in weights):
+        raise ValueError("Weights must not be negative: %r" % value)
+    return weights
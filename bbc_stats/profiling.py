@@ -0,0 +1,134 @@
+"""
+Per-stage timing hooks for bbc-stats and bbc-sync.
+
+Code reports pipeline stages through this module and nothing is recorded until an entry point
+calls start() (the --profile option):
+
+    with profiling.stage("RoundsCollection.parse"):
+        ...
+
+    @profiling.timed("render.power_rankings")
+    def render_power_rankings(self):
+        ...
+"""
+import time
+import json
+import atexit
+import cProfile
+import datetime
+import functools
+import threading
+import contextlib
+
+_profiler = None
+
+
+class Profiler(object):
+    """ Collects wall time and call counts per stage, individual samples and run metadata """
+
+    def __init__(self, command, pstats_path=None):
+        self.command = command
+        self.pstats_path = pstats_path
+        self.started_at = datetime.datetime.now().isoformat(timespec="seconds")
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.samples = {}
+        self.metadata = {}
+        self.lock = threading.Lock()
+        self.cprofile = cProfile.Profile() if pstats_path else None
+
+    def record(self, name, seconds):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "max": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += seconds
+            stage["max"] = max(stage["max"], seconds)
+
+    def sample(self, name, seconds, **info):
+        self.record(name, seconds)
+        with self.lock:
+            self.samples.setdefault(name, []).append(dict(info, seconds=seconds))
+
+    def report(self):
+        return {
+            "command": self.command,
+            "started_at": self.started_at,
+            "total_seconds": time.perf_counter() - self.start_time,
+            "stages": self.stages,
+            "samples": self.samples,
+            "metadata": self.metadata
+        }
+
+
+def start(command, timings_path=None, pstats_path=None):
+    """
+    Starts recording. The timings JSON (and pstats file) are written when the process exits.
+
+    :param command: Entry point name recorded in the report
+    :param timings_path: Path to write the timings JSON to
+    :param pstats_path: If set, the run is also profiled with cProfile and dumped here
+    """
+    global _profiler
+    _profiler = Profiler(command, pstats_path=pstats_path)
+    if _profiler.cprofile:
+        _profiler.cprofile.enable()
+    atexit.register(stop, timings_path)
+    return _profiler
+
+
+def stop(timings_path=None):
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    if profiler.cprofile:
+        profiler.cprofile.disable()
+        profiler.cprofile.dump_stats(profiler.pstats_path)
+    report = profiler.report()
+    if timings_path:
+        with open(timings_path, "w") as fp:
+            json.dump(report, fp, indent=4, sort_keys=True, default=str)
+    return report
+
+
+def enabled():
+    return _profiler is not None
+
+
+def record(name, seconds):
+    if _profiler is not None:
+        _profiler.record(name, seconds)
+
+
+def sample(name, seconds, **info):
+    """ Records a stage call and keeps the individual measurement, e.g. the latency of one round fetch """
+    if _profiler is not None:
+        _profiler.sample(name, seconds, **info)
+
+
+def set_metadata(key, value):
+    if _profiler is not None:
+        _profiler.metadata[key] = value
+
+
+@contextlib.contextmanager
+def stage(name):
+    if _profiler is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start_time)
+
+
+def timed(name):
+    """ Decorator reporting every call of the wrapped function as stage <name> """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,287 @@
+import bisect
+import datetime
+from collections import deque
+from itertools import groupby
+from operator import itemgetter
+import numpy as np
+from bbc_stats.options import METRICS, SEASON
+
+# Lower scoring averages rank better, more birdies and pars rank better
+METRIC_REVERSE = (False, True, True)
+
+
+def round_weights(count, weighted_rounds=None):
+    """
+    Weights applied to a player's rounds (oldest first) for the weighted averages.
+
+    The last weighted_rounds rounds get weights 2, 5, 26, ... and every other round gets 1.
+    """
+    weight = 1
+    if weighted_rounds is None:
+        return [weight for _ in range(count)]
+    weighted_rounds = int(weighted_rounds) if count >= weighted_rounds else count
+    weights = [weight for _ in range(max(0, count - weighted_rounds))]
+    for _ in range(weighted_rounds):
+        weight = weight + 1
+        weights.append(weight)
+        weight = weight * weight
+    return weights
+
+
+def min_rank(values, reverse=False):
+    """
+    1-based ranks where tied values share the best rank.
+
+    Matches sorted(values, reverse=reverse).index(value) + 1 for every value.
+    """
+    keys = -np.asarray(values) if reverse else np.asarray(values)
+    return np.searchsorted(np.sort(keys), keys, side="left") + 1
+
+
+def round_metrics(round):
+    """ Scoring, birdies or better and pars for one round from Stats.player_scores() """
+    return round["score"], len(round["eagles"]) + len(round["birdies"]), len(round["pars"])
+
+
+class RankingsTable(object):
+    """
+    Scoring, birdie and par series for every player, extracted from Stats.player_scores() in one pass.
+
+    averages and weighted are (metric x player) arrays in the order of METRICS.
+    """
+
+    def __init__(self, raw_data, weighted_rounds=None, min_rounds=0):
+        self.players = [player for player in sorted(raw_data.keys()) if len(raw_data[player]) >= min_rounds]
+        self.rounds = np.array([len(raw_data[player]) for player in self.players], dtype=np.int64)
+        width = int(self.rounds.max()) if len(self.players) else 0
+        values = np.zeros((len(METRICS), len(self.players), width), dtype=np.float64)
+        weights = np.zeros((len(self.players), width), dtype=np.float64)
+        for idx, player in enumerate(self.players):
+            count = len(raw_data[player])
+            if count:
+                values[:, idx, :count] = np.array([round_metrics(round) for round in raw_data[player]]).T
+                weights[idx, :count] = round_weights(count, weighted_rounds)
+        played = self.rounds > 0
+        self.averages = np.zeros((len(METRICS), len(self.players)), dtype=np.float64)
+        self.weighted = np.zeros((len(METRICS), len(self.players)), dtype=np.float64)
+        np.divide(values.sum(axis=2), self.rounds, out=self.averages, where=played)
+        np.divide((values * weights).sum(axis=2), weights.sum(axis=1), out=self.weighted, where=played)
+
+    @classmethod
+    def from_arrays(cls, players, rounds, averages, weighted):
+        """ Table over already computed (metric x player) averages, see WindowedRankings """
+        table = cls.__new__(cls)
+        table.players = players
+        table.rounds = np.asarray(rounds, dtype=np.int64)
+        table.averages = np.asarray(averages, dtype=np.float64).reshape(len(METRICS), len(players))
+        table.weighted = np.asarray(weighted, dtype=np.float64).reshape(len(METRICS), len(players))
+        return table
+
+    def ranks(self):
+        """ (metric x player) array of 1-based ranks on the weighted averages """
+        return np.array([min_rank(self.weighted[idx], reverse=reverse) for idx, reverse in enumerate(METRIC_REVERSE)],
+                        dtype=np.int64).reshape(len(METRICS), len(self.players))
+
+    def averages_list(self, metric):
+        """ [(player, average, weighted), ...] best first, ties in player order """
+        idx = METRICS.index(metric)
+        keys = -self.weighted[idx] if METRIC_REVERSE[idx] else self.weighted[idx]
+        return [(self.players[i], self.averages[idx, i], self.weighted[idx, i])
+                for i in np.argsort(keys, kind="stable")]
+
+    def power_rankings(self, rankings_weights):
+        """
+        Power ranking value for every player.
+
+        :param rankings_weights: Tuple (Scoring, Birdies, Pars)
+        :return: Tuple of (ranks array, power ranking array)
+        """
+        ranks = self.ranks()
+        weights = np.asarray(rankings_weights, dtype=np.float64)
+        return ranks, 100 / (np.multiply(ranks.T, weights).sum(axis=1) / weights.sum())
+
+
+class WindowedRankings(object):
+    """
+    RankingsTables for several date windows from one unbounded Stats.player_scores().
+
+    A window is a number of weeks back from today or SEASON, the calendar year of the latest round.
+    Every player's rounds are sorted by date once into prefix sums, so a window is a binary search for
+    its first round and a difference of prefix sums. Only the last weighted_rounds rounds of a window
+    carry a weight other than 1, those are added on top of the plain sum.
+    """
+
+    def __init__(self, raw_data, weighted_rounds=None, min_rounds=0, today=None):
+        self.weighted_rounds = weighted_rounds
+        self.min_rounds = min_rounds
+        self.today = today or datetime.date.today()
+        self.players = sorted(raw_data.keys())
+        self.series = []
+        latest = None
+        for player in self.players:
+            rounds = sorted(raw_data[player], key=itemgetter("date"))
+            dates = [round["date"].toordinal() for round in rounds]
+            values = np.array([round_metrics(round) for round in rounds], dtype=np.float64).reshape(
+                len(rounds), len(METRICS))
+            prefix = np.zeros((len(rounds) + 1, len(METRICS)), dtype=np.float64)
+            np.cumsum(values, axis=0, out=prefix[1:])
+            self.series.append((dates, values, prefix))
+            if rounds and (latest is None or rounds[-1]["date"] > latest):
+                latest = rounds[-1]["date"]
+        self.season_start = datetime.date(latest.year, 1, 1) if latest is not None else self.today
+
+    def start_date(self, window):
+        """ First date included in window """
+        if window == SEASON:
+            return self.season_start
+        return self.today - datetime.timedelta(weeks=window)
+
+    def table(self, window):
+        start = self.start_date(window).toordinal()
+        players, rounds, totals, weighted_totals, weight_sums = [], [], [], [], []
+        for player, (dates, values, prefix) in zip(self.players, self.series):
+            first = bisect.bisect_left(dates, start)
+            count = len(dates) - first
+            if count == 0 or count < self.min_rounds:
+                continue
+            total = prefix[-1] - prefix[first]
+            weighted_total, weight_sum = total, float(count)
+            if self.weighted_rounds:
+                recent = min(count, int(self.weighted_rounds))
+                weights = np.array(round_weights(recent, recent), dtype=np.float64)
+                weighted_total = total - (prefix[-1] - prefix[-1 - recent]) + weights @ values[-recent:]
+                weight_sum = count - recent + weights.sum()
+            players.append(player)
+            rounds.append(count)
+            totals.append(total)
+            weighted_totals.append(weighted_total)
+            weight_sums.append(weight_sum)
+        shape = (len(players), len(METRICS))
+        averages = np.array(totals, dtype=np.float64).reshape(shape) / np.array(rounds, dtype=np.float64)[:, None]
+        weighted = np.array(weighted_totals, dtype=np.float64).reshape(shape) / np.array(
+            weight_sums, dtype=np.float64)[:, None]
+        return RankingsTable.from_arrays(players, rounds, averages.T, weighted.T)
+
+
+def positions(power_rankings):
+    """
+    1-based power ranking positions of a (player x setting) matrix, ties in player order like
+    power_rankings_list
+    """
+    order = np.argsort(-power_rankings, axis=0, kind="stable")
+    positions = np.empty_like(order)
+    np.put_along_axis(positions, order, np.arange(1, len(power_rankings) + 1)[:, None], axis=0)
+    return positions
+
+
+class WeightSensitivity(object):
+    """
+    Power rankings of one RankingsTable under a grid of (Scoring, Birdies, Pars) weight triples.
+
+    The metric ranks are computed once, power_rankings is a (player x setting) matrix from one
+    broadcast with the same reduction RankingsTable.power_rankings uses, and positions holds every
+    player's place in every setting.
+    """
+
+    def __init__(self, table, weight_grid, rankings_weights):
+        """
+        :param weight_grid: Sequence of weight triples
+        :param rankings_weights: The current weights, positions are compared against these
+        """
+        self.table = table
+        self.weights = np.asarray(weight_grid, dtype=np.float64).reshape(-1, len(METRICS))
+        zero = self.weights[self.weights.sum(axis=1) == 0]
+        if len(zero):
+            raise ValueError("Weight settings must not sum to 0: %s" % ", ".join(
+                ",".join("%g" % weight for weight in weights) for weights in zero))
+        ranks = table.ranks().T[:, None, :]
+        self.power_rankings = 100 / ((ranks * self.weights[None, :, :]).sum(axis=2) / self.weights.sum(axis=1))
+        self.positions = positions(self.power_rankings)
+        base_weights = np.asarray(rankings_weights, dtype=np.float64)[None, None, :]
+        self.base_positions = positions(100 / ((ranks * base_weights).sum(axis=2) / base_weights.sum()))[:, 0]
+
+    def stability(self):
+        """
+        Every player's position spread over the grid, in current position order.
+
+        :return: List of dicts with player, position (with the current weights), best, worst, mean,
+            std and changed, the share of settings that place the player elsewhere
+        """
+        changed = (self.positions != self.base_positions[:, None]).mean(axis=1)
+        stats = []
+        for idx in np.argsort(self.base_positions, kind="stable"):
+            stats.append({
+                "player": self.table.players[idx],
+                "position": int(self.base_positions[idx]),
+                "best": int(self.positions[idx].min()),
+                "worst": int(self.positions[idx].max()),
+                "mean": float(self.positions[idx].mean()),
+                "std": float(self.positions[idx].std()),
+                "changed": float(changed[idx])
+            })
+        return stats
+
+    def rankings(self, setting):
+        """ [{"rank": ..., "player": ..., "power_ranking": ...}, ...] of one setting, best first """
+        return [{"rank": int(self.positions[idx, setting]), "player": self.table.players[idx],
+                 "power_ranking": float(self.power_rankings[idx, setting])}
+                for idx in np.argsort(self.positions[:, setting], kind="stable")]
+
+    def leader_changes(self):
+        """ Number of settings whose leader is not the leader with the current weights """
+        if not len(self.table.players):
+            return 0
+        leader = np.argmin(self.base_positions)
+        return int((self.positions[leader] != 1).sum())
+
+
+class RankingsHistory(object):
+    """
+    RankingsTables after every round date, built in one walk over all rounds in date order.
+
+    Each player keeps running sums and the values of their last weighted_rounds rounds, so a new round
+    updates that player's averages without revisiting older rounds. The snapshot for a date equals a
+    RankingsTable over every round up to and including that date.
+    """
+
+    def __init__(self, raw_data, weighted_rounds=None, min_rounds=0):
+        self.players = sorted(raw_data.keys())
+        self.weighted_rounds = int(weighted_rounds) if weighted_rounds else 0
+        self.min_rounds = max(1, min_rounds)
+        # Sorting is stable, a player's rounds on the same date stay in Stats order
+        self.rounds = sorted(((round["date"], idx, round["round"], round_metrics(round))
+                              for idx, player in enumerate(self.players) for round in raw_data[player]),
+                             key=itemgetter(0))
+        self.tail_weights = [np.array(round_weights(count, count), dtype=np.float64)
+                             for count in range(self.weighted_rounds + 1)]
+
+    def snapshots(self):
+        """ Yields (date, round names, RankingsTable) for every round date, oldest first """
+        players = len(self.players)
+        counts = np.zeros(players, dtype=np.int64)
+        sums = np.zeros((players, len(METRICS)), dtype=np.float64)
+        weighted_totals = np.zeros((players, len(METRICS)), dtype=np.float64)
+        weight_sums = np.zeros(players, dtype=np.float64)
+        recent = [deque(maxlen=self.weighted_rounds) for _ in range(players)]
+        for date, rounds in groupby(self.rounds, key=itemgetter(0)):
+            round_names = []
+            for _, idx, round_name, values in rounds:
+                if round_name not in round_names:
+                    round_names.append(round_name)
+                values = np.array(values, dtype=np.float64)
+                counts[idx] += 1
+                sums[idx] += values
+                weighted_totals[idx] = sums[idx]
+                weight_sums[idx] = counts[idx]
+                if self.weighted_rounds:
+                    recent[idx].append(values)
+                    tail = np.array(recent[idx])
+                    weights = self.tail_weights[len(tail)]
+                    weighted_totals[idx] = sums[idx] - tail.sum(axis=0) + weights @ tail
+                    weight_sums[idx] = counts[idx] - len(tail) + weights.sum()
+            eligible = np.nonzero(counts >= self.min_rounds)[0]
+            table = RankingsTable.from_arrays(
+                [self.players[idx] for idx in eligible], counts[eligible],
+                (sums[eligible] / counts[eligible][:, None]).T,
+                (weighted_totals[eligible] / weight_sums[eligible][:, None]).T)
+            yield date, round_names, table
@@ -0,0 +1,83 @@
+import numpy as np
+
+HOLES = 18
+# Sorts after every real score so unplayed holes never win a hole or count in a best ball
+MISSING = np.iinfo(np.int64).max
+
+
+class RoundScores(object):
+    """
+    A round converted once into a players x 18 integer score array.
+
+    Rows follow the order of round["scores"]; teams are stored as an index array into those rows
+    where -1 marks a padded slot or a player without posted scores (it selects the all-MISSING
+    row appended at the end of the padded score array).
+    """
+
+    def __init__(self, round):
+        self.players = list(round["scores"].keys())
+        self.index = {player: idx for idx, player in enumerate(self.players)}
+        self.scores = np.full((len(self.players), HOLES), MISSING, dtype=np.int64)
+        self.totals = np.zeros(len(self.players), dtype=np.int64)
+        self.holes_played = np.zeros(len(self.players), dtype=np.int64)
+        for idx, player in enumerate(self.players):
+            player_scores = round["scores"][player]["scores"]
+            total = 0
+            for hole, info in player_scores.items():
+                total += info["score"]
+                if hole.isdigit() and 1 <= int(hole) <= HOLES:
+                    self.scores[idx, int(hole) - 1] = info["score"]
+            self.totals[idx] = total
+            self.holes_played[idx] = len(player_scores)
+        self.played = self.scores != MISSING
+        team_size = max([len(team) for team in round["teams"]] or [0])
+        self.teams = np.full((len(round["teams"]), team_size), -1, dtype=np.int64)
+        for team_idx, team in enumerate(round["teams"]):
+            for flight, player in enumerate(team):
+                self.teams[team_idx, flight] = self.index.get(player, -1)
+        self._padded = np.vstack([self.scores, np.full((1, HOLES), MISSING, dtype=np.int64)])
+
+    def team_best_ball(self, hole_range, best_ball=2):
+        """
+        Best ball totals for every team over hole_range.
+
+        :return: Array with one total per team
+        """
+        holes = np.array([hole - 1 for hole in hole_range], dtype=np.int64)
+        team_scores = np.sort(self._padded[self.teams][:, :, holes], axis=1)[:, :best_ball, :]
+        return np.where(team_scores == MISSING, 0, team_scores).sum(axis=(1, 2))
+
+    def flights(self):
+        """
+        Flight results for players that finished 18 holes, in order of first appearance.
+
+        :return: List of (flight_idx, [winners], split)
+        """
+        complete = np.append(self.holes_played == HOLES, False)
+        eligible = (self.teams >= 0) & complete[self.teams]
+        if not eligible.any():
+            return []
+        positions = np.flatnonzero(eligible.ravel()) % self.teams.shape[1]
+        _, first = np.unique(positions, return_index=True)
+        results = []
+        for flight in positions[np.sort(first)]:
+            rows = self.teams[:, flight][eligible[:, flight]]
+            totals = self.totals[rows]
+            winning = totals.min()
+            winners = [self.players[row] for row in rows[totals == winning]]
+            results.append((int(flight), winners, int((totals == winning).sum())))
+        return results
+
+    def skins(self):
+        """
+        Holes won outright by a single player.
+
+        :return: Dict of player name to list of holes won
+        """
+        low = self.scores.min(axis=0)
+        won = ((self.scores == low).sum(axis=0) == 1) & (self.played.sum(axis=0) >= 2)
+        winners = self.scores.argmin(axis=0)
+        skins = {}
+        for hole in np.flatnonzero(won):
+            skins.setdefault(self.players[winners[hole]], []).append(int(hole) + 1)
+        return skins
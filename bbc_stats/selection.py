@@ -0,0 +1,146 @@
+"""
+Which of a player's rounds count towards their season points.
+
+A rule is chosen by the points configuration. A "selection" entry describes it as data:
+
+    {"rule": "monthly_cap", "max_per_month": 4}    The latest 4 rounds of every month count
+    {"rule": "replace", "count": 20, "replacements": 5}
+                                                   The first 20 rounds count, the best 5 later rounds
+                                                   replace the worst counted rounds they beat
+    {"rule": "best", "best": 10, "of": 15}         The best 10 of the first 15 rounds count ("of" is optional)
+    {"rule": "drop_worst", "drop": 2}              Every round but the worst 2 counts
+
+Without one, max_rounds_per_month > 0 selects monthly_cap, otherwise season_round_count and
+replacement_scores select replace.
+"""
+import heapq
+from operator import itemgetter
+
+points_key = itemgetter("points")
+date_key = itemgetter("date")
+
+
+class SelectionRule(object):
+    """
+    Marks the counted rounds of a PlayersCollection.generate_points target and sets its points.
+
+    target["all_rounds"] holds the player's rounds sorted by date, target["rounds_by_month"] the same
+    round dicts by month. Ties always go to the earlier round in those lists.
+    """
+
+    def select(self, target):
+        raise NotImplementedError("Selection rules must implement select method.")
+
+    def params(self):
+        """ The rule's configuration, rules with equal params select the same rounds """
+        return (self.__class__.__name__,) + tuple(sorted(vars(self).items()))
+
+    @staticmethod
+    def mark_official(target, counted):
+        """ Flags the rounds named in counted official and sums their points in date order """
+        for round in target["all_rounds"]:
+            round["official"] = round["name"] in counted
+            round["over_limit"] = not round["official"]
+        target["points"] = sum([r["points"] for r in target["all_rounds"] if r["official"]])
+
+
+class MonthlyCap(SelectionRule):
+    """ The latest max_per_month rounds of every month count, the others are ignored """
+
+    def __init__(self, max_per_month):
+        self.max_per_month = max_per_month
+
+    def select(self, target):
+        target["points"] = 0
+        for month, rounds in target["rounds_by_month"].items():
+            # Equal to sorted(rounds, key=date, reverse=True)[:max_per_month], order included
+            counted = heapq.nlargest(self.max_per_month, rounds, key=date_key)
+            counted_names = set(r["name"] for r in counted)
+            ignored = sorted([r for r in rounds if r["name"] not in counted_names], key=date_key, reverse=True)
+            target["ignored_rounds"].extend(r["name"] for r in ignored)
+            target["points"] += sum([r["points"] for r in counted])
+            for round in rounds:
+                round["ignored"] = round["name"] not in counted_names
+
+
+class ReplaceRounds(SelectionRule):
+    """
+    The first count rounds are official. The best replacements later rounds each replace the worst
+    not yet replaced official round, as long as they score more points than it.
+    """
+
+    def __init__(self, count, replacements):
+        self.count = count
+        self.replacements = replacements
+
+    def select(self, target):
+        all_rounds = target["all_rounds"]
+        by_name = {r["name"]: r for r in all_rounds}
+        counted = sorted(all_rounds[:self.count], key=points_key)
+        # Equal to sorted(..., key=points, reverse=True)[:replacements], order included
+        extra_rounds = heapq.nlargest(self.replacements, all_rounds[self.count:], key=points_key)
+        counted_names = set(r["name"] for r in counted)
+        for round in all_rounds:
+            round["official"] = round["name"] in counted_names
+            round["over_limit"] = not round["official"]
+        # Extras come best first and counted rounds worst first, so the first extra that does not beat
+        # the worst remaining round can not beat any other and neither can the extras after it
+        for replaced, extra in zip(counted, extra_rounds):
+            if not extra["points"] > replaced["points"]:
+                break
+            by_name[replaced["name"]]["replaced_by"] = extra["name"]
+            by_name[replaced["name"]]["official"] = False
+            by_name[extra["name"]]["replaces"] = replaced["name"]
+            by_name[extra["name"]]["official"] = True
+        target["points"] = sum([r["points"] for r in all_rounds if r["official"]])
+
+
+class BestRounds(SelectionRule):
+    """ The best rounds of the first of rounds (of every round if of is None) count """
+
+    def __init__(self, best, of=None):
+        self.best = best
+        self.of = of
+
+    def select(self, target):
+        considered = target["all_rounds"] if self.of is None else target["all_rounds"][:self.of]
+        self.mark_official(target, set(r["name"] for r in heapq.nlargest(self.best, considered, key=points_key)))
+
+
+class DropWorst(SelectionRule):
+    """ Every round but the worst drop rounds counts """
+
+    def __init__(self, drop):
+        self.drop = drop
+
+    def select(self, target):
+        all_rounds = target["all_rounds"]
+        # The latest of equal rounds is dropped first, so ties keep the earlier round like BestRounds
+        dropped = heapq.nsmallest(self.drop, reversed(all_rounds), key=points_key)
+        dropped_names = set(r["name"] for r in dropped)
+        self.mark_official(target, set(r["name"] for r in all_rounds if r["name"] not in dropped_names))
+
+
+RULES = {
+    "monthly_cap": MonthlyCap,
+    "replace": ReplaceRounds,
+    "best": BestRounds,
+    "drop_worst": DropWorst
+}
+
+
+def selection_rule(points_config):
+    """ The SelectionRule of a points configuration """
+    selection = points_config.get("selection")
+    if selection is not None:
+        params = dict(selection)
+        rule = params.pop("rule", None)
+        if rule not in RULES:
+            raise Exception("Unknown round selection rule %r, expected one of %s" % (rule, ", ".join(RULES)))
+        try:
+            return RULES[rule](**params)
+        except TypeError as exc:
+            raise Exception("Invalid %s round selection %r: %s" % (rule, selection, exc))
+    if points_config["max_rounds_per_month"] > 0:
+        return MonthlyCap(points_config["max_rounds_per_month"])
+    return ReplaceRounds(points_config["season_round_count"], points_config["replacement_scores"])
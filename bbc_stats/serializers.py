@@ -0,0 +1,91 @@
+"""
+Serializer backends for the YAML front matter and JSON data files written by GithubSiteBase.
+
+Output is byte-identical to yaml.dump (pure-Python Dumper) and json.dumps:
+
+- yaml "c" uses libyaml's CDumper, which shares the Dumper representer. libyaml only differs for
+  empty mapping keys and for double-quoted scalars wider than the line width. Documents showing
+  either are re-dumped with the pure-Python Dumper.
+- json "ujson" is used when installed. It only differs from json.dumps in exponent float notation
+  and in escaping DEL, so documents containing an exponent, "Inf" or DEL are re-encoded with the
+  stdlib encoder.
+
+select() picks the backends, "auto" picks the fastest available one.
+"""
+import re
+import json
+import yaml
+from bbc_stats import profiling
+
+try:
+    from yaml import CDumper
+except ImportError:
+    CDumper = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+YAML_BACKENDS = ("auto", "c", "python")
+JSON_BACKENDS = ("auto", "ujson", "json")
+YAML_WIDTH = 80
+UJSON_KWARGS = {"indent", "sort_keys"}
+_yaml_empty_key = re.compile(r"^[ -]*'': ", re.MULTILINE)
+_json_divergent = re.compile("[0-9][eE]|Inf|\x7f")
+
+yaml_backend = "python"
+json_backend = "json"
+fallbacks = {"yaml": 0, "json": 0}
+
+
+def select(yaml_name="auto", json_name="auto"):
+    """
+    Selects the serializer backends and reports them in the profiling metadata.
+
+    :return: Tuple (yaml backend, json backend) actually in use
+    """
+    global yaml_backend, json_backend
+    if yaml_name not in YAML_BACKENDS:
+        raise Exception("Unknown yaml backend: %s" % yaml_name)
+    if json_name not in JSON_BACKENDS:
+        raise Exception("Unknown json backend: %s" % json_name)
+    if yaml_name == "c" and CDumper is None:
+        raise Exception("yaml backend c requires PyYAML built with libyaml")
+    if json_name == "ujson" and ujson is None:
+        raise Exception("json backend ujson requires the ujson package")
+    if yaml_name == "auto":
+        yaml_name = "c" if CDumper is not None else "python"
+    if json_name == "auto":
+        json_name = "ujson" if ujson is not None else "json"
+    yaml_backend, json_backend = yaml_name, json_name
+    profiling.set_metadata("serializers", {"yaml": yaml_backend, "json": json_backend, "fallbacks": fallbacks})
+    return yaml_backend, json_backend
+
+
+def _yaml_diverges(text):
+    if _yaml_empty_key.search(text):
+        return True
+    return any(len(line) > YAML_WIDTH and '"' in line for line in text.splitlines())
+
+
+def dump_yaml(value, **kwargs):
+    if yaml_backend == "c" and "Dumper" not in kwargs:
+        text = yaml.dump(value, Dumper=CDumper, **kwargs)
+        if not _yaml_diverges(text):
+            return text
+        fallbacks["yaml"] += 1
+    return yaml.dump(value, **kwargs)
+
+
+def dump_json(value, **kwargs):
+    # Without indent ujson uses compact separators, json.dumps does not
+    if json_backend == "ujson" and kwargs.get("indent") and set(kwargs) <= UJSON_KWARGS:
+        try:
+            text = ujson.dumps(value, escape_forward_slashes=False, **kwargs)
+        except (TypeError, OverflowError, ValueError):
+            text = None
+        if text is not None and not _json_divergent.search(text):
+            return text
+        fallbacks["json"] += 1
+    return json.dumps(value, **kwargs)
@@ -0,0 +1,186 @@
+"""
+bbc-stats serve answers JSON queries for rankings, points, players and rounds over HTTP.
+
+Results are loaded and scored once, every response body is serialized up front and requests are
+dictionary lookups. Round file changes are picked up like --watch and swap in a new set of responses.
+
+    GET /rankings                   Power rankings, /rankings/<window> for every --windows window
+    GET /points                     Points standings
+    GET /players, /players/<name>   Player names, a player's points and rounds by name or site file name
+    GET /rounds, /rounds/<name>     Round names, a scored round
+"""
+import json
+import time
+import asyncio
+import hashlib
+from operator import itemgetter
+from urllib.parse import unquote
+from bbc_stats import generate
+from bbc_stats import profiling
+from bbc_stats.data import GithubData
+from bbc_stats.options import window_label
+from bbc_stats.watch import ResultsWatcher
+
+REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed"
+}
+
+
+class Response(object):
+    """ A serialized JSON body and its ETag """
+
+    def __init__(self, value):
+        self.body = json.dumps(value, default=generate.json_default_encoder, sort_keys=True).encode("utf-8")
+        self.etag = '"%s"' % hashlib.sha1(self.body).hexdigest()
+
+    def matches(self, if_none_match):
+        if if_none_match is None:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags or "W/" + self.etag in tags
+
+
+def points_standings(players_data):
+    """ Players by points, ranked like the bbc-stats points table """
+    standings = []
+    for idx, player_data in enumerate(sorted(players_data.values(), key=itemgetter("points"), reverse=True)):
+        standings.append({
+            "rank": idx + 1,
+            "player": player_data["name"],
+            "points": player_data["points"],
+            "rounds": player_data["rounds"],
+            "flight_wins": player_data["flight_wins"],
+            "skins": player_data["skins"],
+            "overall_wins": player_data["overall_wins"],
+            "front_wins": player_data["front_wins"],
+            "back_wins": player_data["back_wins"]
+        })
+    return standings
+
+
+class ResultsServer(ResultsWatcher):
+    """
+    Keeps the ResultsStore, RoundsCollection, PlayersCollection and PowerRankings outputs in memory
+    and serves them as JSON with ETag / If-None-Match support.
+    """
+
+    def __init__(self, args):
+        super(ResultsServer, self).__init__(args)
+        # Player images are looked up in the github site when there is one
+        self.site_directory = args.github_site or "."
+        self.responses = {}
+
+    @profiling.timed("serve.update")
+    def update(self):
+        start_time = time.perf_counter()
+        pr = generate.load_power_rankings(self.args, self.store)
+        rounds_data = self.rounds.parse(self.site_directory)
+        self.players.add_rounds(rounds_data)
+        players_data = self.players.parse(self.site_directory)
+        github_data = GithubData(self.store, stats_obj=pr.stats)
+        github_data.invalid_rounds = self.rounds.invalid_rounds
+        player_data = github_data.parse(self.site_directory)
+
+        responses = {
+            "/rankings": Response(pr.power_rankings()),
+            "/points": Response(points_standings(players_data)),
+            "/players": Response(sorted(player["name"] for player in players_data.values())),
+            "/rounds": Response([{"name": round_name, "date": round["date"], "valid": round["valid"]}
+                                 for round_name, round in rounds_data.items()])
+        }
+        for window in self.args.windows or ():
+            responses["/rankings/%s" % window_label(window)] = Response(pr.window_power_rankings(window))
+        for filename, player in players_data.items():
+            scores = player_data.get(player["name"], {})
+            response = Response(dict(player, scoring_average=scores.get("scoring_average"),
+                                     scores=scores.get("rounds", [])))
+            responses["/players/%s" % player["name"]] = response
+            responses["/players/%s" % filename] = response
+        for round_name, round in rounds_data.items():
+            responses["/rounds/%s" % round_name] = Response(round)
+        # Requests in flight keep answering from the previous responses until this swap
+        self.responses = responses
+        print("Serving %d players and %d rounds, computed in %.2f seconds" % (
+            len(players_data), len(rounds_data), time.perf_counter() - start_time))
+
+    def respond(self, method, target, headers):
+        """ :return: Tuple (status, headers, body) """
+        if method not in ("GET", "HEAD"):
+            return 405, {"Allow": "GET, HEAD"}, Response({"error": "Method not allowed"}).body
+        path = unquote(target.split("?", 1)[0]).rstrip("/") or "/"
+        response = self.responses.get(path)
+        if response is None:
+            return 404, {}, Response({"error": "Not found", "path": path}).body
+        response_headers = {"ETag": response.etag, "Cache-Control": "no-cache"}
+        if response.matches(headers.get("if-none-match")):
+            return 304, response_headers, b""
+        return 200, response_headers, response.body
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    status, response_headers, body = 400, {}, Response({"error": "Bad request"}).body
+                else:
+                    status, response_headers, body = self.respond(parts[0], parts[1], headers)
+                keep_alive = len(parts) == 3 and parts[2] == "HTTP/1.1" and \
+                    headers.get("connection", "").lower() != "close"
+                if status != 304:
+                    response_headers["Content-Type"] = "application/json"
+                    response_headers["Content-Length"] = str(len(body))
+                response_headers["Connection"] = "keep-alive" if keep_alive else "close"
+                lines = ["HTTP/1.1 %d %s" % (status, REASONS[status])]
+                lines.extend("%s: %s" % header for header in response_headers.items())
+                if parts and parts[0] == "HEAD":
+                    body = b""
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def poll_forever(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.args.watch_interval)
+            try:
+                # Rounds are re-read and scored off the event loop, queries keep being answered meanwhile
+                await loop.run_in_executor(None, self.poll)
+            except Exception as exc:
+                print("Refreshing %s failed: %r" % (self.store.results_directory, exc))
+
+    def serve(self):
+        self.update()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_server(self.handle, self.args.host, self.args.port))
+        poller = loop.create_task(self.poll_forever())
+        print("Serving %s on http://%s:%d, polling for round changes every %.1f seconds" % (
+            self.store.results_directory, self.args.host, self.args.port, self.args.watch_interval))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            print("Stopped serving %s" % self.store.results_directory)
+        finally:
+            poller.cancel()
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
@@ -0,0 +1,368 @@
+import re
+import os
+import json
+import pickle
+import hashlib
+import datetime
+import shutil
+import tempfile
+from bbc_stats import profiling
+
+MONTH_IDX = ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+             'august', 'september', 'october', 'november', 'december']
+CACHE_FILENAME = ".bbc-stats-cache.pickle"
+# 3: entries always carry the content hash
+CACHE_VERSION = 3
+# Partition index, kept beside the round files in the results directory so it must not end in .json
+PARTITIONS_FILENAME = ".bbc-partitions"
+PARTITION_REGEXP = re.compile(r'^\d{4}$')
+# Read once at import, os.umask can only be read by setting it, which is not safe once threads write files
+_umask = os.umask(0)
+os.umask(_umask)
+# Year of rounds without season metadata in an unpartitioned results directory, they predate multi-season storage
+DEFAULT_SEASON = 2021
+ROUND_REGEXP = re.compile(
+    r'Round\s+(?P<round_id>\d+)\s+\((Fri|Sat|Sun|Mon|Tue|Wed|Thu)\,\s+(?P<month>\w+)\s+(?P<day>\d+)\)')
+
+
+def default_year(season=None, points_config=None):
+    """ Year of rounds without season metadata: season, else the year of the points config's fedex_cup_start_date """
+    if season is None and points_config and "fedex_cup_start_date" in points_config:
+        return datetime.date.fromisoformat(points_config["fedex_cup_start_date"]).year
+    return season
+
+
+def parse_round_name(name, year=None):
+    m = ROUND_REGEXP.search(name)
+    if m:
+        round_info = m.groupdict()
+        return datetime.date(
+            year or DEFAULT_SEASON,
+            MONTH_IDX.index(
+                round_info["month"].lower()) + 1,
+            int(round_info["day"]))
+
+
+class ResultsStore(object):
+    """
+    Loads, parses and date-stamps every round in a results directory exactly once.
+
+    A single store is shared by every GithubSiteBase collection and by PowerRankings, so the
+    collections never read round files themselves. The power rankings still come from golfgenius
+    Stats, which reads and parses the round files again from stats_directory(): player scores and
+    scoring averages are computed by golfgenius and bbc-stats does not reproduce them. A run
+    therefore reads the rounds once for the store and once per Stats object.
+
+    When cache is enabled the parsed rounds are kept in a pickle sidecar inside each results
+    directory. Entries are keyed by file name and invalidated when the file mtime or size
+    changes (or its content hash, when verify_hash is set), so a warm start only reads the
+    rounds that are new or changed.
+
+    Results may be partitioned by season into <results_directory>/<year>/ directories, rounds
+    directly in results_directory are the unpartitioned root and are always loaded. A round's
+    year is its "season" metadata, else its partition's year, else default_year. The partitions
+    and their date ranges are indexed in results_directory, and only partitions overlapping
+    start_date to end_date are opened.
+    """
+
+    def __init__(self, results_directory, cache=False, verify_hash=False, start_date=None, end_date=None,
+                 default_year=None):
+        self.results_directory = results_directory
+        self.cache = cache
+        self.verify_hash = verify_hash
+        self.start_date = start_date
+        self.end_date = end_date
+        self.default_year = default_year or DEFAULT_SEASON
+        self.cache_path = os.path.join(results_directory, CACHE_FILENAME)
+        self.index_path = os.path.join(results_directory, PARTITIONS_FILENAME)
+        self.results = {}
+        self.paths = {}
+        # Content hash of every round read from a file, see RoundsCollection.derived_cache
+        self.hashes = {}
+        self.partitions = {}
+        self.loaded_partitions = []
+        self.loaded_rounds = 0
+        self.cached_rounds = 0
+        self._stats_view = None
+        self.load()
+
+    @staticmethod
+    def _file_hash(path):
+        with open(path, 'rb') as fp:
+            return hashlib.sha1(fp.read()).hexdigest()
+
+    def _read_cache(self, directory):
+        cache_path = os.path.join(directory, CACHE_FILENAME)
+        if not self.cache or not os.path.isfile(cache_path):
+            return {}
+        try:
+            with open(cache_path, 'rb') as fp:
+                cached = pickle.load(fp)
+        except Exception as exc:
+            print("Ignoring unreadable results cache %s: %s" % (cache_path, exc))
+            return {}
+        if cached.get("version") != CACHE_VERSION:
+            return {}
+        return cached["entries"]
+
+    def _write_cache(self, directory, entries):
+        write_atomic(os.path.join(directory, CACHE_FILENAME),
+                     pickle.dumps({"version": CACHE_VERSION, "entries": entries}, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def _read_index(self):
+        if not os.path.isfile(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r') as fp:
+                index = json.load(fp)
+        except ValueError as exc:
+            print("Ignoring unreadable partitions index %s: %s" % (self.index_path, exc))
+            return {}
+        return index.get("partitions", {})
+
+    def _write_index(self, partitions):
+        write_atomic(self.index_path, json.dumps({"partitions": partitions}, indent=4, sort_keys=True).encode("utf-8"))
+
+    @staticmethod
+    def _scan_partition(path, year):
+        """ Date range of a partition from its round file names, without opening them """
+        dates = []
+        undated = False
+        for f in os.listdir(path):
+            if f.endswith('.json'):
+                round_date = parse_round_name(f[:-len('.json')], year)
+                if round_date is None:
+                    undated = True
+                else:
+                    dates.append(round_date)
+        return {
+            "year": year,
+            "mtime": os.stat(path).st_mtime_ns,
+            "rounds": len(dates) + int(undated),
+            "start": str(min(dates)) if dates else None,
+            "end": str(max(dates)) if dates else None,
+            "undated": undated
+        }
+
+    def _update_index(self):
+        """ Re-scans partitions whose directory changed since the index was written """
+        index = self._read_index()
+        partitions = {}
+        for name in os.listdir(self.results_directory):
+            path = os.path.join(self.results_directory, name)
+            if PARTITION_REGEXP.match(name) and os.path.isdir(path):
+                partition = index.get(name)
+                if partition is None or partition["mtime"] != os.stat(path).st_mtime_ns:
+                    partition = self._scan_partition(path, int(name))
+                partitions[name] = partition
+        if partitions != index:
+            self._write_index(partitions)
+        return partitions
+
+    def overlaps(self, partition):
+        if partition["rounds"] == 0:
+            return False
+        if partition["undated"]:
+            return True
+        if self.start_date is not None and datetime.date.fromisoformat(partition["end"]) < self.start_date:
+            return False
+        if self.end_date is not None and datetime.date.fromisoformat(partition["start"]) > self.end_date:
+            return False
+        return True
+
+    def _cached_entry(self, entry, path, stat):
+        if entry is None:
+            return None, None
+        content_hash = None
+        if entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            if not self.verify_hash:
+                return entry, None
+            content_hash = self._file_hash(path)
+            if entry["hash"] == content_hash:
+                return entry, content_hash
+        elif self.verify_hash and entry["hash"] is not None and entry["size"] == stat.st_size:
+            # Touched but unchanged files keep their parsed entry
+            content_hash = self._file_hash(path)
+            if entry["hash"] == content_hash:
+                entry = dict(entry, mtime=stat.st_mtime_ns)
+                return entry, content_hash
+        return None, content_hash
+
+    @profiling.timed("results.load")
+    def load(self):
+        self.results = {}
+        self.paths = {}
+        self.hashes = {}
+        self.loaded_partitions = []
+        self.loaded_rounds = 0
+        self.cached_rounds = 0
+        self._stats_view = None
+        self._load_directory(self.results_directory, None)
+        self.partitions = self._update_index()
+        index_dirty = False
+        for name, partition in sorted(self.partitions.items()):
+            if self.overlaps(partition):
+                path = os.path.join(self.results_directory, name)
+                self._load_directory(path, partition["year"])
+                self.loaded_partitions.append(name)
+                # Writing the partition's cache changes its mtime, which must not invalidate its index entry
+                mtime = os.stat(path).st_mtime_ns
+                index_dirty = index_dirty or mtime != partition["mtime"]
+                partition["mtime"] = mtime
+        if index_dirty:
+            self._write_index(self.partitions)
+        if self.cache:
+            print("Loaded %d rounds from %s (%d from cache)" % (
+                self.loaded_rounds + self.cached_rounds, self.results_directory, self.cached_rounds))
+
+    def _load_directory(self, directory, year):
+        cached_entries = self._read_cache(directory)
+        entries = {}
+        dirty = False
+        for f in os.listdir(directory):
+            if f.endswith('.json'):
+                path = os.path.join(directory, f)
+                stat = os.stat(path)
+                entry, content_hash = self._cached_entry(cached_entries.get(f), path, stat)
+                if entry is not None:
+                    self.cached_rounds += 1
+                    dirty = dirty or entry is not cached_entries[f]
+                else:
+                    with open(path, 'rb') as fp:
+                        content = fp.read()
+                    data = json.loads(content)
+                    self.loaded_rounds += 1
+                    content_hash = hashlib.sha1(content).hexdigest()
+                    entry = {
+                        "mtime": stat.st_mtime_ns,
+                        "size": stat.st_size,
+                        "hash": content_hash,
+                        "name": data["name"],
+                        "results": data["results"]
+                    }
+                    dirty = True
+                if entry["name"] in self.paths:
+                    raise Exception("Round %s is stored in both %s and %s" % (
+                        entry["name"], self.paths[entry["name"]], path))
+                self.add_round(entry["name"], entry["results"], path=path, year=year)
+                if entry["hash"] is not None:
+                    self.hashes[entry["name"]] = entry["hash"]
+                entries[f] = entry
+        if self.cache and (dirty or set(entries) != set(cached_entries)):
+            self._write_cache(directory, entries)
+
+    def add_round(self, round_name, results, path=None, year=None, round_date=None):
+        """
+        Adds or replaces a round and stamps its date.
+
+        :param path: Round file, used to order rounds and to build the Stats view
+        :param year: Year of the round's partition, used when the round has no season metadata
+        :param round_date: Date of the round, derived from its name and year if None
+        """
+        if round_date is None:
+            round_date = parse_round_name(round_name, results.get("season") or year or self.default_year)
+        if round_date is None:
+            print("Unable to find round_info date for round_info %s, assuming today..." % round_name)
+            round_date = datetime.date.today()
+        results["date"] = round_date
+        self.results[round_name] = results
+        self.hashes.pop(round_name, None)
+        if path is not None:
+            self.paths[round_name] = path
+
+    def read_round(self, path):
+        """
+        (Re-)reads a single round file into the store, e.g. after it changed on disk.
+
+        :return: The round name
+        """
+        with open(path, 'rb') as fp:
+            content = fp.read()
+        data = json.loads(content)
+        partition = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        year = int(partition) if PARTITION_REGEXP.match(partition) and os.path.normpath(
+            os.path.dirname(path)) != os.path.normpath(self.results_directory) else None
+        previous = [name for name, round_path in self.paths.items() if round_path == path and name != data["name"]]
+        for name in previous:
+            self.remove_round(name)
+        self.add_round(data["name"], data["results"], path=path, year=year)
+        self.hashes[data["name"]] = hashlib.sha1(content).hexdigest()
+        self.loaded_rounds += 1
+        return data["name"]
+
+    def remove_round(self, round_name):
+        self.results.pop(round_name, None)
+        self.paths.pop(round_name, None)
+        self.hashes.pop(round_name, None)
+
+    def order_by_directory(self):
+        """
+        Re-orders the rounds in place to the order load() would give, e.g. after add_round() was called for
+        rounds written by a sync in this process.
+        """
+        root = os.path.normpath(self.results_directory)
+        directories = {os.path.normpath(os.path.dirname(path)) for path in self.paths.values()}
+        order = {}
+        for directory in sorted(directories, key=lambda d: (d != root, d)):
+            for f in os.listdir(directory):
+                if f.endswith(".json"):
+                    order[os.path.join(directory, f)] = len(order)
+        paths = {name: os.path.join(os.path.normpath(os.path.dirname(path)), os.path.basename(path))
+                 for name, path in self.paths.items()}
+        rounds = sorted(self.results.items(), key=lambda item: order.get(paths.get(item[0]), len(order)))
+        self.results.clear()
+        self.results.update(rounds)
+
+    def stats_directory(self):
+        """
+        Directory for golfgenius Stats to read. That is results_directory when every round is in the
+        unpartitioned root, otherwise a temporary directory linking every loaded round file.
+        """
+        root = os.path.normpath(self.results_directory)
+        if all(os.path.normpath(os.path.dirname(path)) == root for path in self.paths.values()):
+            return self.results_directory
+        if self._stats_view is None:
+            self._stats_view = tempfile.TemporaryDirectory(prefix="bbc-stats-")
+        linked = {os.path.basename(path) for path in self.paths.values()}
+        for f in os.listdir(self._stats_view.name):
+            if f not in linked:
+                os.remove(os.path.join(self._stats_view.name, f))
+        for path in self.paths.values():
+            link = os.path.join(self._stats_view.name, os.path.basename(path))
+            if not os.path.lexists(link):
+                try:
+                    os.symlink(os.path.abspath(path), link)
+                except OSError:
+                    shutil.copyfile(path, link)
+        return self._stats_view.name
+
+    def all_players(self):
+        players = set()
+        for result in self.results.values():
+            for team in result["teams"]:
+                for player in team:
+                    players.add(player)
+        return list(players)
+
+
+def write_atomic(path, content):
+    """
+    Writes content (str or bytes) to a temporary file in the same directory and renames it over path.
+
+    The file keeps the mode of the file it replaces, a new file gets the mode open() would give it rather
+    than the owner-only mode of the temporary file.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~_umask
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(content, bytes) else "w") as fp:
+            fp.write(content)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,195 @@
+"""
+What-if standings for many points configurations from one parse of the rounds.
+
+    bbc-stats sweep --points-config-file points.json --sweep-file variants.json
+
+A variants file is a list of points config overrides, or a grid such as
+{"fw": [1, 2], "s": [0.5, 1], "max_rounds_per_month": [0, 4]} whose every combination is a variant.
+"""
+import json
+import datetime
+import itertools
+import numpy as np
+from terminaltables import SingleTable
+from bbc_stats import generate
+from bbc_stats import profiling
+from bbc_stats.selection import MonthlyCap, ReplaceRounds, BestRounds, DropWorst, selection_rule
+
+EVENTS = ("fw", "s", "fr", "ba", "ov")
+SELECTION_KEYS = ("max_rounds_per_month", "season_round_count", "replacement_scores", "selection")
+SWEEP_KEYS = EVENTS + SELECTION_KEYS
+
+
+def load_variants(path, points_config):
+    """
+    Reads a variants file into full points configs, the unchanged points_config first.
+
+    :return: List of (label, points config)
+    """
+    with open(path, "r") as fp:
+        overrides = json.load(fp)
+    if isinstance(overrides, dict):
+        keys = list(overrides.keys())
+        overrides = [dict(zip(keys, values)) for values in itertools.product(*[overrides[key] for key in keys])]
+    variants = [("base", points_config)]
+    for override in overrides:
+        unknown = set(override) - set(SWEEP_KEYS)
+        if unknown:
+            raise Exception("Can not sweep %s, only %s" % (", ".join(sorted(unknown)), ", ".join(SWEEP_KEYS)))
+        label = " ".join("%s=%s" % (key, json.dumps(value)) for key, value in override.items()
+                         if points_config.get(key) != value)
+        if label:
+            variants.append((label, dict(points_config, **override)))
+    return variants
+
+
+class PointsSweep(object):
+    """
+    Every player's per-round event counts, extracted once from parsed rounds.
+
+    A counted round (one the player had a team in) is a row of coefficients, one per point value:
+    1/split for every flight won, skins won and 1/split for front, back and overall wins. The
+    points of every round under every config are then one matrix product, followed by the same
+    round selection PlayersCollection.generate_points makes, see selection.selection_rule.
+    """
+
+    def __init__(self, rounds_data):
+        """
+        :param rounds_data: RoundsCollection.parse() output
+        """
+        players = {}
+        rows = []
+        for round_name, round in rounds_data.items():
+            if not round.get("teams"):
+                continue
+            round_date = datetime.date.fromordinal(round["date_timestamp"])
+            for team in round["teams"]:
+                for player in set(x["name"] for x in team["players"]):
+                    coefficients = [0.0] * len(EVENTS)
+                    for flight_idx, winners in round["flight_winners"].items():
+                        if player in winners:
+                            coefficients[0] += 1.0 / round["flight_splits"][flight_idx]
+                    coefficients[1] = float(len(round["skins"].get(player, [])))
+                    for idx, nassau in ((2, "front"), (3, "back"), (4, "overall")):
+                        if team[nassau]:
+                            coefficients[idx] = 1.0 / team[nassau + "_split"]
+                    rows.append((players.setdefault(player, len(players)), round_date, coefficients))
+        self.players = list(players.keys())
+        self.player_idx = np.array([row[0] for row in rows], dtype=np.int64)
+        self.dates = [row[1] for row in rows]
+        self.coefficients = np.array([row[2] for row in rows], dtype=np.float64).reshape(len(rows), len(EVENTS))
+        self.rounds = np.bincount(self.player_idx, minlength=len(self.players))
+        # Every player's rows ordered by date, ties in round order like generate_points' stable sort
+        self.player_rows = [[] for _ in self.players]
+        for row in sorted(range(len(rows)), key=lambda row: self.dates[row]):
+            self.player_rows[self.player_idx[row]].append(row)
+
+    def round_points(self, configs):
+        """ Rows x configs matrix of round points """
+        weights = np.array([[float(config[event]) for event in EVENTS] for config in configs], dtype=np.float64)
+        return self.coefficients @ weights.T
+
+    def monthly_mask(self, max_rounds_per_month):
+        """ The rows counted under a monthly cap: every player's latest rounds of each month """
+        mask = np.zeros(len(self.dates), dtype=bool)
+        for rows in self.player_rows:
+            months = {}
+            # Latest first, equal dates keep their order like sorted(..., reverse=True)
+            for row in sorted(rows, key=lambda row: self.dates[row], reverse=True):
+                month = months.setdefault(self.dates[row].month, [])
+                if len(month) < max_rounds_per_month:
+                    month.append(row)
+                    mask[row] = True
+        return mask
+
+    def replaced_points(self, points, season_round_count, replacement_scores):
+        """
+        Players x configs points of replace_rounds: the first season_round_count rounds count,
+        the best replacement_scores later rounds replace the worst counted rounds they beat.
+        """
+        totals = np.zeros((len(self.players), points.shape[1]))
+        for player, rows in enumerate(self.player_rows):
+            counted = np.sort(points[rows[:season_round_count]], axis=0)
+            extra = -np.sort(-points[rows[season_round_count:]], axis=0)[:replacement_scores]
+            replaced = min(len(counted), len(extra))
+            # Best extras against worst counted rounds, the gains only shrink so greedy replacement stops
+            # at the first extra that does not beat its round
+            gains = np.maximum(extra[:replaced] - counted[:replaced], 0)
+            totals[player] = counted.sum(axis=0) + gains.sum(axis=0)
+        return totals
+
+    def best_points(self, points, best, of=None):
+        """ Players x configs points of the best rounds among every player's first of rounds """
+        totals = np.zeros((len(self.players), points.shape[1]))
+        for player, rows in enumerate(self.player_rows):
+            considered = points[rows if of is None else rows[:of]]
+            totals[player] = -np.sort(-considered, axis=0)[:best].sum(axis=0)
+        return totals
+
+    def drop_worst_points(self, points, drop):
+        """ Players x configs points of every round but the worst drop rounds """
+        totals = np.zeros((len(self.players), points.shape[1]))
+        for player, rows in enumerate(self.player_rows):
+            totals[player] = np.sort(points[rows], axis=0)[drop:].sum(axis=0)
+        return totals
+
+    @profiling.timed("sweep.standings")
+    def standings(self, configs):
+        """ Players x configs matrix of points """
+        points = self.round_points(configs)
+        totals = np.zeros((len(self.players), len(configs)))
+        groups = {}
+        for idx, config in enumerate(configs):
+            rule = selection_rule(config)
+            groups.setdefault(rule.params(), (rule, []))[1].append(idx)
+        for rule, columns in groups.values():
+            if isinstance(rule, MonthlyCap):
+                mask = self.monthly_mask(rule.max_per_month)
+                group_totals = np.zeros((len(self.players), len(columns)))
+                np.add.at(group_totals, self.player_idx[mask], points[mask][:, columns])
+                totals[:, columns] = group_totals
+            elif isinstance(rule, ReplaceRounds):
+                totals[:, columns] = self.replaced_points(points[:, columns], rule.count, rule.replacements)
+            elif isinstance(rule, BestRounds):
+                totals[:, columns] = self.best_points(points[:, columns], rule.best, rule.of)
+            elif isinstance(rule, DropWorst):
+                totals[:, columns] = self.drop_worst_points(points[:, columns], rule.drop)
+            else:
+                raise Exception("Can not sweep round selection %s" % rule.__class__.__name__)
+        return totals
+
+
+def ranks(points):
+    """ 1-based rank of every player in every column, most points first """
+    order = np.argsort(-points, axis=0, kind="stable")
+    ranks = np.empty_like(order)
+    for column in range(points.shape[1]):
+        ranks[order[:, column], column] = np.arange(1, points.shape[0] + 1)
+    return ranks
+
+
+def run_sweep(args):
+    """ Prints (and optionally writes) the standings of every variant in args.sweep_file """
+    if not args.sweep_file:
+        raise Exception("bbc-stats sweep needs --sweep-file")
+    store = generate.load_results_store(args)
+    rounds = generate.load_rounds_collection(args, store)
+    sweep = PointsSweep(rounds.parse("."))
+    variants = load_variants(args.sweep_file, rounds.points_config)
+    points = sweep.standings([config for _, config in variants])
+    player_ranks = ranks(points)
+    table = [["Player", "Rounds"] + [label for label, _ in variants]]
+    for player in np.argsort(player_ranks[:, 0], kind="stable"):
+        table.append([sweep.players[player], int(sweep.rounds[player])] + [
+            "%.2f (%d)" % (points[player, column], player_ranks[player, column]) for column in range(len(variants))])
+    print(SingleTable(table, title="Points by variant (rank)").table)
+    if args.sweep_output:
+        data = []
+        for column, (label, config) in enumerate(variants):
+            standings = [{"rank": int(player_ranks[player, column]), "player": sweep.players[player],
+                          "points": float(points[player, column]), "rounds": int(sweep.rounds[player])}
+                         for player in np.argsort(player_ranks[:, column], kind="stable")]
+            data.append({"variant": label, "points_config": config, "standings": standings})
+        with open(args.sweep_output, "w") as fp:
+            json.dump({"variants": data}, fp, indent=4)
+    return variants, points
@@ -5,17 +5,25 @@ import argparse
 import os
 import warnings
 import sys
-
-
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    from golfgenius.parser import GGParser
+import time
+import queue
+import shlex
+import hashlib
+import datetime
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from bbc_stats import profiling
+from bbc_stats.store import write_atomic, default_year
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.NullHandler())
 
+# Lives in the results directory, so no .json extension or bbc-stats would load it as a round
+MANIFEST_FILENAME = ".bbc-sync-manifest"
+
 
 def parse_args():
 
@@ -27,6 +35,9 @@ def parse_args():
     parser.add_argument('--sync-all', action='store_true', help='If set, previously collected data will be re-synced.')
     parser.add_argument('--results-directory', default='./results', type=str, metavar='<PATH>',
                         help="The directory to output result JSON files.")
+    parser.add_argument('--season', type=int, metavar='<year>',
+                        help="Write rounds to the <year> season partition of the results directory and record "
+                             "the season in each round.")
     parser.add_argument('--disable-screenshots', action='store_true',
                         help="Turn off screenshots")
     parser.add_argument("--screenshots-directory", type=str, metavar='<PATH>', default='screenshots',
@@ -40,11 +51,253 @@ def parse_args():
     parser.add_argument("--logfile", type=str, metavar='<PATH>',
                         help="Send logs to a file.")
     parser.add_argument("--debug", action='store_true', help="Turn on debug logging.")
+    parser.add_argument('--changed-rounds-file', type=str, metavar='<PATH>',
+                        help="Write the names of new or changed rounds to this file, one per line.")
+    parser.add_argument('--profile', metavar='<PATH>',
+                        help="Record per-stage and per-round fetch timings and write them as JSON to this file.")
+    parser.add_argument('--profile-stats', metavar='<PATH>',
+                        help="Also profile the run with cProfile and write the pstats file here.")
+    parser.add_argument('--results-database', metavar='<PATH>',
+                        help="Also write every synced round through to this SQLite results database.")
+    parser.add_argument('--points-config-file', metavar='<PATH>',
+                        help="The bbc-stats points configuration. The year of its fedex_cup_start_date dates "
+                             "rounds without --season in --results-database, like bbc-stats --import-results.")
+    parser.add_argument('--then-stats', action='store_true',
+                        help="Run bbc-stats in this process, scoring rounds in memory as they are synced.")
+    parser.add_argument('--stats-args', default='', type=str, metavar='<ARGS>',
+                        help="bbc-stats arguments used with --then-stats, e.g. \"--github-site ../site --weeks 4\".")
+    parser.add_argument('--workers', default=1, type=int, metavar='<integer>',
+                        help="Number of browser sessions to sync rounds with in parallel. With --sync-all the "
+                             "rounds already in the sync manifest are dealt out evenly. GGParser cannot list new "
+                             "rounds up front, so those are split by a hash of their names and may be uneven.")
+    parser.add_argument('--retries', default=2, type=int, metavar='<integer>',
+                        help="Times to restart a browser session after a failed round before giving up.")
+    parser.add_argument('--retry-backoff', default=5.0, type=float, metavar='<seconds>',
+                        help="Seconds to wait before the first retry, doubled on every following retry.")
     return parser.parse_args()
 
 
+# Inline flags such as (?i) must stay at the start of a combined pattern
+GLOBAL_FLAGS_REGEXP = re.compile(r'^\(\?[aiLmsux]+\)')
+
+
+def name_hash_pattern(bits, hashes):
+    """
+    Lookahead matching names whose ASCII character codes XOR to one of hashes in their low bits.
+
+    Every bit of the XOR is the parity of the characters with that bit set, which a regular
+    expression can test without backtracking.
+    """
+    parities = []
+    for bit in range(bits):
+        chars = "".join(re.escape(chr(code)) if 32 <= code < 127 else "\\x%02x" % code
+                        for code in range(128) if code >> bit & 1)
+        parities.append(("(?=(?:[^{0}]*[{0}][^{0}]*[{0}])*[^{0}]*\\Z)".format(chars),
+                         "(?=[^{0}]*[{0}](?:[^{0}]*[{0}][^{0}]*[{0}])*[^{0}]*\\Z)".format(chars)))
+    return "(?:%s)" % "|".join("".join(parities[bit][value >> bit & 1] for bit in range(bits))
+                               for value in hashes)
+
+
+class RoundFilter(object):
+    """
+    Round name filter handed to GGParser.iter_rounds.
+
+    Combines the --filter regular expression with the round names this session already synced and
+    this worker's share of the round names. GGParser is given compile(), a plain compiled pattern
+    like --filter. The known round names --filter matches are dealt out to the workers in turn, the
+    ones GGParser finds beyond those are split by a hash of the name that a regular expression can
+    test.
+    """
+
+    def __init__(self, regexp, worker=0, workers=1, exclude=None, known=()):
+        self.regexp = regexp
+        self.worker = worker
+        self.workers = workers
+        self.exclude = exclude if exclude is not None else set()
+        # Dealt once, exclude grows differently in every worker as rounds are synced
+        self.known = [name for name in sorted(set(known)) if name not in self.exclude and regexp.search(name)]
+        self.assigned = self.known[worker::workers]
+
+    def compile(self):
+        """ Pattern whose search() matches the names --filter matches, unless excluded or of another worker """
+        pattern = self.regexp.pattern
+        flags = GLOBAL_FLAGS_REGEXP.match(pattern)
+        parts = [flags.group(0) if flags else "", r"\A"]
+        if flags:
+            pattern = pattern[flags.end():]
+        if self.exclude:
+            parts.append(r"(?!(?:%s)\Z)" % "|".join(re.escape(name) for name in sorted(self.exclude)))
+        if self.workers > 1:
+            # A few hash values per worker keep the split even when workers is not a power of 2
+            bits = (4 * self.workers - 1).bit_length()
+            partition = name_hash_pattern(bits, range(self.worker, 2 ** bits, self.workers))
+            if self.known:
+                partition = r"(?!(?:%s)\Z)%s" % ("|".join(re.escape(name) for name in self.known), partition)
+            if self.assigned:
+                partition = r"(?:(?=(?:%s)\Z)|%s)" % ("|".join(re.escape(name) for name in self.assigned),
+                                                     partition)
+            # Case-insensitive --filter flags must not fold the character codes the hash is made of
+            parts.append("(?-i:%s)" % partition)
+        # Lookahead at every position keeps the search() semantics of --filter, anchors included
+        parts.append(r"(?=[\s\S]*?(?:%s))" % pattern)
+        return re.compile("".join(parts), self.regexp.flags)
+
+
+def load_default_year(args):
+    """ Year --results-database dates rounds without season metadata with, the one bbc-stats would use """
+    points_config = None
+    if args.points_config_file:
+        with open(args.points_config_file, "r") as fp:
+            points_config = json.load(fp)
+    return default_year(args.season, points_config)
+
+
+def season_directory(args):
+    """ Directory rounds are written to, the --season partition of the results directory if set """
+    if args.season is not None:
+        return os.path.join(args.results_directory, str(args.season))
+    return args.results_directory
+
+
+class SyncManifest(object):
+    """
+    Records every synced round with a content hash and timestamps in <results>/.bbc-sync-manifest.
+
+    The manifest also tracks the rounds completed by the current run. When a run is interrupted,
+    the next run with the same GGID, filter and --sync-all setting skips the rounds it already
+    completed. Round files are only rewritten when their content changed.
+    """
+
+    def __init__(self, results_directory):
+        self.results_directory = results_directory
+        self.path = os.path.join(results_directory, MANIFEST_FILENAME)
+        self.lock = threading.Lock()
+        self.changed = []
+        self.unchanged = []
+        if os.path.isfile(self.path):
+            with open(self.path, "r") as fp:
+                self.data = json.load(fp)
+        else:
+            self.data = {"rounds": {}, "run": None}
+
+    @staticmethod
+    def now():
+        return datetime.datetime.now().isoformat(timespec="seconds")
+
+    def save(self):
+        write_atomic(self.path, json.dumps(self.data, indent=4, sort_keys=True))
+
+    def start_run(self, ggid, pattern, sync_all):
+        """
+        :return: Set of round names already synced by an interrupted run with the same parameters
+        """
+        run_key = {"ggid": ggid, "filter": pattern, "sync_all": sync_all}
+        run = self.data.get("run")
+        with self.lock:
+            if run and not run["finished"] and all(run.get(k) == v for k, v in run_key.items()):
+                logger.info("Resuming sync started at {}, {} rounds already synced".format(
+                    run["started_at"], len(run["completed"])))
+            else:
+                self.data["run"] = dict(run_key, started_at=self.now(), finished_at=None, finished=False,
+                                        completed=[])
+            self.save()
+            return set(self.data["run"]["completed"])
+
+    def finish_run(self):
+        with self.lock:
+            self.data["run"]["finished"] = True
+            self.data["run"]["finished_at"] = self.now()
+            self.save()
+
+    def _file_hash(self, path):
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as fp:
+            return hashlib.sha256(fp.read()).hexdigest()
+
+    @profiling.timed("sync.write_round")
+    def record(self, round_name, result):
+        """
+        Atomically writes a round file if its content changed and records it in the manifest.
+
+        :return: True if the round is new or changed
+        """
+        filename = "{}.json".format(round_name)
+        path = os.path.join(self.results_directory, filename)
+        content = json.dumps(result, indent=4)
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        with self.lock:
+            entry = self.data["rounds"].get(round_name)
+            now = self.now()
+            changed = self._file_hash(path) != digest
+            if changed:
+                write_atomic(path, content)
+                self.changed.append(round_name)
+            else:
+                self.unchanged.append(round_name)
+            self.data["rounds"][round_name] = {
+                "file": filename,
+                "sha256": digest,
+                "synced_at": now,
+                "changed_at": now if changed or entry is None else entry["changed_at"]
+            }
+            self.data["run"]["completed"].append(round_name)
+            self.save()
+        return changed
+
+
+def sync_rounds(args, round_filter, screenshots_directory, on_round):
+    """
+    Syncs the rounds matching round_filter with one GGParser session.
+
+    When the session fails the browser is restarted, with exponential backoff, and resumes after
+    the rounds it already synced. A round that keeps failing is retried args.retries times.
+
+    :param on_round: Called with (round_name, result) as each round completes
+    :return: Number of rounds synced
+    """
+    # Imported here so argument errors and --help do not wait for the browser tooling to load
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from golfgenius.parser import GGParser
+    attempt = 0
+    synced = 0
+    while True:
+        parser = None
+        try:
+            # Failing to start the browser is retried like a failing session
+            with profiling.stage("sync.browser_start"):
+                parser = GGParser(
+                    headless=False if args.show_browser else True,
+                    screenshots_enabled=True if not args.disable_screenshots else False,
+                    screenshot_directory=screenshots_directory,
+                    existing_results=season_directory(args) if not args.sync_all else None)
+            fetch_start = time.perf_counter()
+            for round_name, result in parser.iter_rounds(args.ggid, filter=round_filter.compile()):
+                profiling.sample("sync.fetch_round", time.perf_counter() - fetch_start, round=round_name)
+                on_round(round_name, result)
+                round_filter.exclude.add(round_name)
+                synced += 1
+                attempt = 0
+                fetch_start = time.perf_counter()
+            return synced
+        except Exception as exc:
+            attempt += 1
+            if attempt > args.retries:
+                raise
+            delay = args.retry_backoff * 2 ** (attempt - 1)
+            logger.warning("Sync session failed ({}), retrying in {:.1f} seconds (attempt {} of {})".format(
+                exc, delay, attempt, args.retries))
+            time.sleep(delay)
+        finally:
+            if parser is not None:
+                parser.close()
+
+
 def main():
     args = parse_args()
+    if args.profile or args.profile_stats:
+        profiling.start("bbc-sync", timings_path=args.profile, pstats_path=args.profile_stats)
     logging_level = logging.DEBUG if args.debug else logging.INFO
     logging_formatter = logging.Formatter('%(asctime)s <%(name)s:%(module)s[%(lineno)d]> %(levelname)s: %(message)s',
                                           '%a %b %d %H:%M:%S')
@@ -62,31 +315,131 @@ def main():
     if not args.disable_screenshots:
         os.makedirs(args.screenshots_directory, exist_ok=True)
 
-    if not os.path.isdir(args.results_directory):
-        os.mkdir(args.results_directory)
+    os.makedirs(season_directory(args), exist_ok=True)
 
     logger.info("Refreshing BBC Results from GGID {} to {} using filter {}".format(
-        args.ggid, args.results_directory, args.filter.pattern
+        args.ggid, season_directory(args), args.filter.pattern
     ))
 
-    parser = GGParser(
-        headless=False if args.show_browser else True,
-        screenshots_enabled=True if not args.disable_screenshots else False,
-        screenshot_directory=args.screenshots_directory,
-        existing_results=args.results_directory if not args.sync_all else None)
-
-    synced_rounds = 0
-    try:
-        for round_name, result in parser.iter_rounds(args.ggid, filter=args.filter):
-            with open(os.path.join(args.results_directory, "{}.json".format(round_name)), "w") as fp:
-                json.dump(result, fp, indent=4)
-                synced_rounds += 1
-        logger.info("Finished refreshing GGID {}. Results have been stored in {}".format(
-            args.ggid, args.results_directory
-        ))
-        if synced_rounds == 0:
-            sys.exit(1)
-        else:
-            sys.exit(0)
-    finally:
-        parser.close()
+    manifest = SyncManifest(season_directory(args))
+    resumed = manifest.start_run(args.ggid, args.filter.pattern, args.sync_all)
+    if args.then_stats:
+        run_pipeline(args, manifest, resumed)
+    else:
+        run_sync(args, manifest, resumed, default_year=load_default_year(args))
+    synced_rounds = len(resumed) + len(manifest.changed) + len(manifest.unchanged)
+    logger.info("Finished refreshing GGID {}. Results have been stored in {}".format(
+        args.ggid, season_directory(args)
+    ))
+    logger.info("Synced {} rounds: {} new or changed, {} unchanged, {} resumed".format(
+        synced_rounds, len(manifest.changed), len(manifest.unchanged), len(resumed)))
+    for round_name in manifest.changed:
+        logger.info("Changed: {}".format(round_name))
+    if args.changed_rounds_file:
+        write_atomic(args.changed_rounds_file, "".join("{}\n".format(r) for r in manifest.changed))
+    if synced_rounds == 0:
+        sys.exit(1)
+    else:
+        sys.exit(0)
+
+
+def run_sync(args, manifest, resumed, on_round=None, default_year=None):
+    """
+    Syncs every round matching args.filter, with one or args.workers GGParser sessions.
+
+    :param manifest: SyncManifest that writes and records each round
+    :param resumed: Round names already synced by an interrupted run
+    :param on_round: Optionally called with (round_name, result) after each round is recorded
+    :param default_year: Year --results-database dates rounds without season metadata with
+    """
+    database = None
+    if args.results_database:
+        from bbc_stats.database import ResultsDatabase
+        database = ResultsDatabase(args.results_database)
+
+    def record(round_name, result):
+        if args.season is not None:
+            result["results"]["season"] = args.season
+        manifest.record(round_name, result)
+        if database is not None:
+            database.upsert_round(round_name, result["results"], default_year=default_year)
+        if on_round is not None:
+            on_round(round_name, result)
+
+    if args.workers > 1:
+        # Rounds on disk are skipped by GGParser unless --sync-all re-syncs them. Listed before any
+        # session starts recording, so every worker is dealt from the same names
+        known = list(manifest.data["rounds"]) if args.sync_all else []
+        futures = []
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for worker in range(args.workers):
+                screenshots_directory = os.path.join(args.screenshots_directory, "worker-{}".format(worker))
+                if not args.disable_screenshots:
+                    os.makedirs(screenshots_directory, exist_ok=True)
+                futures.append(executor.submit(
+                    sync_rounds, args,
+                    RoundFilter(args.filter, worker=worker, workers=args.workers, exclude=set(resumed),
+                                known=known),
+                    screenshots_directory, record))
+        for future in futures:
+            # Re-raise the first session that failed after every session has finished
+            future.result()
+    else:
+        sync_rounds(args, RoundFilter(args.filter, exclude=set(resumed)), args.screenshots_directory, record)
+    manifest.finish_run()
+
+
+def run_pipeline(args, manifest, resumed):
+    """
+    Syncs rounds on a background thread and hands each one to bbc-stats in memory.
+
+    Fresh rounds go through a queue into the ResultsStore and are scored straight away. While the
+    queue is empty the rounds that were already on disk are scored, so scoring overlaps with
+    scraping. Once the sync finishes, the rankings and site export run on the already loaded data.
+    """
+    from bbc_stats import generate, serializers
+
+    stats_args = generate.parse_args(shlex.split(args.stats_args) + ["--results-directory", args.results_directory])
+    serializers.select(stats_args.yaml_backend, stats_args.json_backend)
+    store = generate.load_results_store(stats_args)
+    rounds = None
+    if stats_args.github_site:
+        rounds = generate.load_rounds_collection(stats_args, store)
+    fresh_rounds = queue.Queue()
+    errors = []
+
+    def produce():
+        try:
+            run_sync(args, manifest, resumed, default_year=store.default_year,
+                     on_round=lambda round_name, result: fresh_rounds.put((round_name, result)))
+        except BaseException as exc:
+            errors.append(exc)
+        finally:
+            fresh_rounds.put(None)
+
+    producer = threading.Thread(target=produce, name="bbc-sync-pipeline")
+    producer.start()
+    backlog = deque(store.results.keys() if rounds is not None else [])
+    while True:
+        try:
+            item = fresh_rounds.get(timeout=0.05 if backlog else None)
+        except queue.Empty:
+            round_name = backlog.popleft()
+            if round_name not in rounds.parsed:
+                with profiling.stage("pipeline.score_round"):
+                    rounds.prime(round_name)
+            continue
+        if item is None:
+            break
+        round_name, result = item
+        store.add_round(round_name, result["results"],
+                        path=os.path.join(season_directory(args), "{}.json".format(round_name)))
+        if rounds is not None:
+            with profiling.stage("pipeline.score_round"):
+                rounds.prime(round_name)
+    producer.join()
+    if errors:
+        raise errors[0]
+    store.order_by_directory()
+    with profiling.stage("pipeline.stats"):
+        generate.run(stats_args, results_store=store, rounds=rounds)
@@ -0,0 +1,134 @@
+"""
+bbc-stats --watch keeps the parsed rounds and collections resident and recomputes only the outputs a
+changed round file affects.
+"""
+import os
+import time
+from bbc_stats import generate
+from bbc_stats import profiling
+from bbc_stats.collection import PlayersCollection
+from bbc_stats.database import DatabaseStore
+from bbc_stats.store import PARTITION_REGEXP
+
+
+def round_players(round):
+    """ Every player on a team or with scores in a round """
+    players = set(round.get("scores", {}).keys())
+    for team in round.get("teams", []):
+        players.update(team)
+    return players
+
+
+class ResultsWatcher(object):
+    """
+    Polls the results directory, and the season partitions in range, for new, changed and removed
+    round files.
+
+    A change re-reads only those files and re-scores only those rounds. Points are recomputed for
+    the players in the old and new version of the rounds, the rankings are refreshed and only site
+    files whose content changed are rewritten. Polling needs no extra dependency and also works on
+    network mounts where inotify events are not delivered.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        # Unchanged site files are never rewritten
+        self.args.incremental = True
+        self.store = generate.load_results_store(args)
+        if isinstance(self.store, DatabaseStore):
+            raise Exception("Watching round files can not be combined with --results-database")
+        self.rounds = generate.load_rounds_collection(args, self.store)
+        self.players = PlayersCollection(self.store, points_config=self.rounds.points_config,
+                                         blacklisted_rounds=self.rounds.blacklisted_rounds)
+        self.snapshot = self.scan()
+
+    def in_range(self, year):
+        return ((self.store.start_date is None or year >= self.store.start_date.year) and
+                (self.store.end_date is None or year <= self.store.end_date.year))
+
+    def directories(self):
+        directories = [self.store.results_directory]
+        for name in sorted(os.listdir(self.store.results_directory)):
+            path = os.path.join(self.store.results_directory, name)
+            if PARTITION_REGEXP.match(name) and os.path.isdir(path) and self.in_range(int(name)):
+                directories.append(path)
+        return directories
+
+    def scan(self):
+        """ {path: (mtime, size)} of every watched round file """
+        files = {}
+        for directory in self.directories():
+            for f in os.listdir(directory):
+                if f.endswith('.json'):
+                    path = os.path.join(directory, f)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def update(self):
+        """ Recomputes the outputs from the resident store and collections """
+        generate.run(self.args, results_store=self.store, rounds=self.rounds, players=self.players)
+
+    def watch(self):
+        self.update()
+        print("Watching %s for round changes every %.1f seconds" % (
+            self.store.results_directory, self.args.watch_interval))
+        try:
+            while True:
+                time.sleep(self.args.watch_interval)
+                self.poll()
+        except KeyboardInterrupt:
+            print("Stopped watching %s" % self.store.results_directory)
+
+    def poll(self):
+        """
+        Refreshes the outputs if round files changed since the last poll.
+
+        :return: True if anything changed
+        """
+        snapshot = self.scan()
+        if snapshot == self.snapshot:
+            return False
+        # Wait for a sync that is still writing rounds to finish
+        while True:
+            time.sleep(self.args.watch_interval)
+            settled = self.scan()
+            if settled == snapshot:
+                break
+            snapshot = settled
+        changed = [path for path, stat in snapshot.items() if self.snapshot.get(path) != stat]
+        removed = [path for path in self.snapshot if path not in snapshot]
+        self.snapshot = snapshot
+        self.refresh(changed, removed)
+        return True
+
+    @profiling.timed("watch.refresh")
+    def refresh(self, changed, removed):
+        start_time = time.perf_counter()
+        round_names = {path: round_name for round_name, path in self.store.paths.items()}
+        stale_players = set()
+        for path in removed + changed:
+            round_name = round_names.get(path)
+            if round_name is not None:
+                stale_players |= round_players(self.store.results[round_name])
+                self.rounds.parsed.pop(round_name, None)
+                if path in removed:
+                    self.store.remove_round(round_name)
+        for path in changed:
+            try:
+                round_name = self.store.read_round(path)
+            except (ValueError, KeyError, OSError) as exc:
+                print("Skipping unreadable round file %s: %s" % (path, exc))
+                # Retried on the next poll
+                self.snapshot.pop(path, None)
+                continue
+            stale_players |= round_players(self.store.results[round_name])
+            self.rounds.parsed.pop(round_name, None)
+        self.store.order_by_directory()
+        self.players.stale_players = stale_players
+        self.update()
+        print("Updated %d changed and %d removed round files, %d players, in %.2f seconds" % (
+            len(changed), len(removed), len(stale_players), time.perf_counter() - start_time))
@@ -0,0 +1,269 @@
+"""
+Times the bbc-stats pipeline stages against a synthetic (or existing) results directory.
+
+    python benchmarks/run_benchmarks.py --players 80 --rounds 120 --seasons 3 --output bench.json
+    python benchmarks/run_benchmarks.py --players 80 --rounds 120 --seasons 3 --compare bench.json
+
+Results are written as JSON so runs from different commits can be compared.
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import tempfile
+import statistics
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate_results, points_config  # noqa: E402
+from bbc_stats.store import ResultsStore, CACHE_FILENAME  # noqa: E402
+from bbc_stats.database import ResultsDatabase, DatabaseStore  # noqa: E402
+from bbc_stats.derived import DerivedCache, DERIVED_FILENAME  # noqa: E402
+from bbc_stats.collection import RoundsCollection, PlayersCollection  # noqa: E402
+from bbc_stats.data import GithubData  # noqa: E402
+from bbc_stats.generate import PowerRankings, RenderOutput  # noqa: E402
+from bbc_stats.rankings import WindowedRankings, SEASON  # noqa: E402
+from bbc_stats.sweep import PointsSweep  # noqa: E402
+from bbc_stats.selection import ReplaceRounds, MonthlyCap  # noqa: E402
+from bbc_stats import serializers  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--results-directory', metavar='<PATH>',
+                        help="Benchmark an existing results directory instead of generating one.")
+    parser.add_argument('--points-config-file', metavar='<PATH>',
+                        help="Points configuration to use with --results-directory.")
+    parser.add_argument('--players', default=40, type=int, help="Synthetic league size")
+    parser.add_argument('--rounds', default=60, type=int, help="Synthetic rounds per season")
+    parser.add_argument('--team-size', default=4, type=int, help="Synthetic players per team")
+    parser.add_argument('--seasons', default=1, type=int, help="Synthetic seasons")
+    parser.add_argument('--seed', default=0, type=int, help="Synthetic random seed")
+    parser.add_argument('--partitioned', action='store_true', help="Write every synthetic season to its own partition")
+    parser.add_argument('--repeat', default=3, type=int, help="Times to run every benchmark")
+    parser.add_argument('--jobs', default=1, type=int, help="Also time RoundsCollection.parse with this many jobs")
+    parser.add_argument('--output', metavar='<PATH>', help="Write results JSON to this file")
+    parser.add_argument('--compare', metavar='<PATH>', help="Compare against a previous results JSON file")
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+class Benchmarks(object):
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.timings = {}
+
+    def time(self, name, func, setup=None):
+        """ Runs func <repeat> times with stdout silenced and records min/median wall time """
+        runs = []
+        value = None
+        for _ in range(self.repeat):
+            args = setup() if setup else ()
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                value = func(*args)
+                runs.append(time.perf_counter() - start)
+        self.timings[name] = {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+        print("{:<32} min {:>9.4f}s  median {:>9.4f}s".format(name, min(runs), statistics.median(runs)))
+        return value
+
+
+def rounds_by_month(rounds):
+    months = {}
+    for round in rounds:
+        months.setdefault(round["date"].month, []).append(round)
+    return months
+
+
+def data_collection(store, pr, rounds):
+    data = GithubData(store, stats_obj=pr.stats)
+    data.invalid_rounds = rounds.invalid_rounds
+    return data
+
+
+def run(args, results_directory, config, site_directory, database_path):
+    bench = Benchmarks(args.repeat)
+
+    def drop_cache():
+        for directory, _, files in os.walk(results_directory):
+            if CACHE_FILENAME in files:
+                os.remove(os.path.join(directory, CACHE_FILENAME))
+        return ()
+
+    bench.time("store.load", lambda: ResultsStore(results_directory))
+    bench.time("store.load.cache_cold", lambda: ResultsStore(results_directory, cache=True), setup=drop_cache)
+    store = bench.time("store.load.cache_warm", lambda: ResultsStore(results_directory, cache=True))
+    if store.partitions:
+        # Loading the latest season should not depend on how many older seasons are stored
+        latest_season = datetime.date(max(partition["year"] for partition in store.partitions.values()), 1, 1)
+        bench.time("store.load.latest_season",
+                   lambda: ResultsStore(results_directory, cache=True, start_date=latest_season))
+
+    database = ResultsDatabase(database_path)
+
+    def clear_database():
+        with database.connection:
+            for table in ("rounds", "teams", "player_rounds", "hole_scores"):
+                database.connection.execute("DELETE FROM %s" % table)
+        return ()
+    bench.time("database.import", lambda: database.import_store(store), setup=clear_database)
+    bench.time("store.load.database", lambda: DatabaseStore(database))
+    some_player = store.all_players()[0]
+    bench.time("database.player_last_10_rounds", lambda: database.player_rounds(some_player, limit=10))
+
+    # A collection keeps the rounds it parsed, every run gets a new one
+    rounds = None
+
+    def rounds_parse():
+        nonlocal rounds
+        rounds = RoundsCollection(store, points_config=config)
+        return rounds.parse(site_directory)
+    rounds_data = bench.time("rounds.parse", rounds_parse)
+    if args.jobs > 1:
+        bench.time("rounds.parse.jobs_{}".format(args.jobs),
+                   lambda: RoundsCollection(store, points_config=config, jobs=args.jobs).parse(site_directory))
+    derived_path = os.path.join(os.path.dirname(database_path), DERIVED_FILENAME)
+
+    def derived_rounds(cold):
+        if cold and os.path.exists(derived_path):
+            os.remove(derived_path)
+        return (RoundsCollection(store, points_config=config, derived_cache=DerivedCache(derived_path)),)
+    bench.time("rounds.parse.derived_cold", lambda collection: collection.parse(site_directory),
+               setup=lambda: derived_rounds(True))
+    bench.time("rounds.parse.derived_warm", lambda collection: collection.parse(site_directory),
+               setup=lambda: derived_rounds(False))
+
+    # 100 points configs, half with a monthly cap, from one extraction of the round events
+    sweep = PointsSweep(rounds_data)
+    sweep_configs = [dict(config, fw=fw, s=s, max_rounds_per_month=cap)
+                     for fw in (0.5, 1, 2, 3, 4) for s in (0, 0.5, 1, 1.5, 2) for cap in (0, 0, 4, 6)]
+    bench.time("sweep.standings_100", lambda: sweep.standings(sweep_configs))
+
+    def players_parse():
+        players = PlayersCollection(store, points_config=config)
+        players.add_rounds(rounds_data)
+        return players.parse(site_directory)
+    bench.time("players.parse", players_parse)
+
+    # One long season: 1000 rounds, 300 counted and 300 replacement rounds
+    long_season = [{"name": "Round %d" % idx, "points": (idx * 7919) % 13 / 4.0,
+                    "date": datetime.date(2021, 1, 1) + datetime.timedelta(days=idx % 365)} for idx in range(1000)]
+
+    def long_season_target():
+        rounds = sorted([dict(r, replaced_by=None, replaces=None) for r in long_season], key=lambda r: r["date"])
+        return ({"all_rounds": rounds, "ignored_rounds": [], "rounds_by_month": rounds_by_month(rounds)},)
+    bench.time("selection.replace_long_season", ReplaceRounds(300, 300).select, setup=long_season_target)
+    bench.time("selection.monthly_cap_long_season", MonthlyCap(20).select, setup=long_season_target)
+
+    pr = bench.time("rankings.load", lambda: PowerRankings(store, weighted_rounds=2, rankings_weights=[4, 5, 2]))
+
+    def power_rankings():
+        pr._table = None
+        return pr.power_rankings()
+    bench.time("rankings.power_rankings", power_rankings)
+
+    # 10 x 10 x 10 weight settings
+    weight_grid = [[1, 2, 3, 4, 5, 6, 7, 8, 9, 10]] * 3
+    bench.time("rankings.weight_sensitivity_1000", lambda: pr.weight_sensitivity(weight_grid).stability())
+
+    # Synthetic seasons are in the past, windows are taken back from the latest round
+    latest = max(round["date"] for rounds_list in pr.raw_data.values() for round in rounds_list)
+
+    def windows():
+        windowed = WindowedRankings(pr.raw_data, weighted_rounds=2, today=latest)
+        return [windowed.table(window).power_rankings([4, 5, 2]) for window in (4, 8, 12, SEASON)]
+    bench.time("rankings.windows", windows)
+
+    bench.time("data.parse", lambda: data_collection(store, pr, rounds).parse(site_directory))
+
+    for yaml_backend, json_backend in (("python", "json"), ("auto", "auto")):
+        yaml_backend, json_backend = serializers.select(yaml_backend, json_backend)
+        for collection in (rounds, data_collection(store, pr, rounds)):
+            bench.time("{}.export.{}".format(collection.__class__.__name__,
+                                             yaml_backend if collection.output_format == "yaml" else json_backend),
+                       lambda: collection.export(site_directory))
+
+    render_args = argparse.Namespace(player_filter=".*", no_excel=False)
+    cwd = os.getcwd()
+    os.chdir(site_directory)
+    try:
+        for renderer in ("render_round_count", "render_scoring_averages", "render_birdies_averages",
+                         "render_pars_averages", "render_power_rankings"):
+            def render():
+                out = RenderOutput(render_args, pr)
+                getattr(out, renderer)()
+                out.close()
+            bench.time("render.{}".format(renderer[len("render_"):]), render)
+    finally:
+        os.chdir(cwd)
+    return bench.timings
+
+
+def compare(timings, previous):
+    print("\n{:<32} {:>10} {:>10} {:>8}".format("benchmark", "previous", "current", "ratio"))
+    for name, timing in timings.items():
+        if name in previous["timings"]:
+            before = previous["timings"][name]["min"]
+            print("{:<32} {:>9.4f}s {:>9.4f}s {:>7.2f}x".format(name, before, timing["min"],
+                                                               before / timing["min"] if timing["min"] else 0))
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="bbc-bench-") as tmp:
+        site_directory = os.path.join(tmp, "site")
+        os.makedirs(os.path.join(site_directory, "assets", "images"))
+        if args.results_directory:
+            results_directory = args.results_directory
+            if args.points_config_file:
+                with open(args.points_config_file, "r") as fp:
+                    config = json.load(fp)
+            else:
+                config = points_config(seasons=1, first_season=2021)
+        else:
+            results_directory = os.path.join(tmp, "results")
+            generate_results(results_directory, players=args.players, rounds=args.rounds,
+                             team_size=args.team_size, seasons=args.seasons, seed=args.seed,
+                             partitioned=args.partitioned)
+            config = points_config(seasons=args.seasons)
+        timings = run(args, results_directory, config, site_directory, os.path.join(tmp, "results.sqlite"))
+    report = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {
+            "results_directory": args.results_directory,
+            "players": args.players,
+            "rounds": args.rounds,
+            "team_size": args.team_size,
+            "seasons": args.seasons,
+            "partitioned": args.partitioned,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "jobs": args.jobs
+        },
+        "timings": timings
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=4)
+    if args.compare:
+        with open(args.compare, "r") as fp:
+            compare(timings, json.load(fp))
+
+
+if __name__ == "__main__":
+    main()
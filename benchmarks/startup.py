@@ -0,0 +1,98 @@
+"""
+Times the startup of the bbc-stats and bbc-sync entry points, each run in a fresh interpreter.
+
+    python benchmarks/startup.py --output startup.json
+    python benchmarks/startup.py --compare startup.json
+
+Covers importing each entry point module, --help and a short bbc-stats --dump --no-excel run
+against a small synthetic results directory. Results use the run_benchmarks.py JSON format.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import generate_results  # noqa: E402
+from run_benchmarks import git_commit, compare  # noqa: E402
+
+ENTRY_POINTS = {
+    "bbc-stats": "bbc_stats.generate",
+    "bbc-sync": "bbc_stats.sync_golfgenius"
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--repeat', default=10, type=int, help="Times to start every command")
+    parser.add_argument('--players', default=12, type=int, help="Synthetic league size of the --dump run")
+    parser.add_argument('--rounds', default=8, type=int, help="Synthetic rounds of the --dump run")
+    parser.add_argument('--output', metavar='<PATH>', help="Write results JSON to this file")
+    parser.add_argument('--compare', metavar='<PATH>', help="Compare against a previous results JSON file")
+    return parser.parse_args()
+
+
+def entry_point(module, argv):
+    """ Python source running the main() of module like its console script does with argv """
+    return "import sys; from {} import main; sys.argv = {!r}; main()".format(module, argv)
+
+
+def commands(results_directory):
+    yield "python.startup", "pass"
+    for name, module in ENTRY_POINTS.items():
+        yield "{}.import".format(name), "import {}".format(module)
+        yield "{}.help".format(name), entry_point(module, [name, "--help"])
+    yield "bbc-stats.dump", entry_point(ENTRY_POINTS["bbc-stats"], [
+        "bbc-stats", "--results-directory", results_directory, "--dump", "--no-excel", "--no-results-cache"])
+
+
+def time_command(source, repeat, cwd):
+    """ Runs source in <repeat> fresh interpreters and records min/median wall time """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + [p for p in [os.environ.get("PYTHONPATH")] if p]))
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", source], cwd=cwd, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        runs.append(time.perf_counter() - start)
+    return {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def main():
+    args = parse_args()
+    timings = {}
+    with tempfile.TemporaryDirectory(prefix="bbc-startup-") as tmp:
+        results_directory = os.path.join(tmp, "results")
+        generate_results(results_directory, players=args.players, rounds=args.rounds)
+        for name, source in commands(results_directory):
+            timings[name] = time_command(source, args.repeat, tmp)
+            print("{:<32} min {:>9.4f}s  median {:>9.4f}s".format(
+                name, timings[name]["min"], timings[name]["median"]))
+    report = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {
+            "players": args.players,
+            "rounds": args.rounds,
+            "repeat": args.repeat
+        },
+        "timings": timings
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=4)
+    if args.compare:
+        with open(args.compare, "r") as fp:
+            compare(timings, json.load(fp))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Generates synthetic results directories in the same JSON shape bbc-sync writes.
+
+    python benchmarks/synthetic.py ./bench-results --players 60 --rounds 80 --seasons 2
+"""
+import os
+import json
+import random
+import datetime
+import argparse
+
+PARS = [4, 4, 3, 5, 4, 4, 3, 5, 4, 4, 3, 4, 5, 4, 4, 3, 5, 4]
+# Relative to par, weighted towards pars and bogeys
+SCORE_DELTAS = [-2, -1, -1, 0, 0, 0, 0, 1, 1, 1, 2, 3]
+
+
+def round_name(round_id, date):
+    return "Round {} ({}, {} {})".format(round_id, date.strftime("%a"), date.strftime("%B"), date.day)
+
+
+def generate_results(results_directory, players=40, rounds=60, team_size=4, seasons=1, first_season=2021,
+                     incomplete_rate=0.002, seed=0, partitioned=False):
+    """
+    Writes <rounds> rounds per season for a league of <players> players.
+
+    Rounds are spread every few days from March through the season, each round has a random
+    number of full teams and a small share of players do not finish 18 holes. When partitioned,
+    every season is written to its own <results_directory>/<year>/ partition.
+
+    :return: List of round names written
+    """
+    rnd = random.Random(seed)
+    os.makedirs(results_directory, exist_ok=True)
+    names = ["Player{:03d}, Synthetic".format(idx) for idx in range(players)]
+    max_teams = max(2, players // team_size)
+    written = []
+    round_id = 0
+    for season in range(seasons):
+        start = datetime.date(first_season + season, 3, 1)
+        season_directory = results_directory
+        if partitioned:
+            season_directory = os.path.join(results_directory, str(start.year))
+            os.makedirs(season_directory, exist_ok=True)
+        spacing = max(1, 240 // max(1, rounds))
+        for idx in range(rounds):
+            round_id += 1
+            date = start + datetime.timedelta(days=idx * spacing)
+            name = round_name(round_id, date)
+            teams_count = rnd.randint(2, max_teams)
+            field = rnd.sample(names, min(players, teams_count * team_size))
+            teams = [field[pos:pos + team_size] for pos in range(0, len(field) - team_size + 1, team_size)]
+            scores = {}
+            for player in [player for team in teams for player in team]:
+                holes = {}
+                for hole, par in enumerate(PARS, 1):
+                    holes[str(hole)] = {"score": max(1, par + rnd.choice(SCORE_DELTAS)), "par": par}
+                if rnd.random() < incomplete_rate:
+                    del holes[str(rnd.randint(1, 18))]
+                scores[player] = {"scores": holes}
+            data = {
+                "name": name,
+                "results": {
+                    "teams": teams,
+                    "scores": scores,
+                    "gg_url": "https://www.golfgenius.com/synthetic/{}".format(round_id)
+                }
+            }
+            if partitioned:
+                data["results"]["season"] = start.year
+            with open(os.path.join(season_directory, "{}.json".format(name)), "w") as fp:
+                json.dump(data, fp, indent=4)
+            written.append(name)
+    return written
+
+
+def points_config(seasons=1, first_season=2021, **overrides):
+    """ A points configuration whose FedEx cup season covers every generated round """
+    config = {
+        "fw": 1, "s": 1, "fr": 1, "ba": 1, "ov": 1,
+        "max_rounds_per_month": 0,
+        "season_round_count": 20,
+        "replacement_scores": 5,
+        "min_players": 8,
+        "fedex_cup_start_date": "{}-01-01".format(first_season),
+        "fedex_cup_end_date": "{}-12-31".format(first_season + seasons - 1)
+    }
+    config.update(overrides)
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('results_directory', metavar='<PATH>', help="Directory to write round JSON files to")
+    parser.add_argument('--players', default=40, type=int, help="Players in the league")
+    parser.add_argument('--rounds', default=60, type=int, help="Rounds per season")
+    parser.add_argument('--team-size', default=4, type=int, help="Players per team")
+    parser.add_argument('--seasons', default=1, type=int, help="Number of seasons")
+    parser.add_argument('--first-season', default=2021, type=int, help="Year of the first season")
+    parser.add_argument('--seed', default=0, type=int, help="Random seed")
+    parser.add_argument('--partitioned', action='store_true', help="Write every season to its own partition")
+    parser.add_argument('--points-config-file', metavar='<PATH>',
+                        help="Also write a matching points configuration to this file")
+    args = parser.parse_args()
+    written = generate_results(args.results_directory, players=args.players, rounds=args.rounds,
+                               team_size=args.team_size, seasons=args.seasons, first_season=args.first_season,
+                               seed=args.seed, partitioned=args.partitioned)
+    if args.points_config_file:
+        with open(args.points_config_file, "w") as fp:
+            json.dump(points_config(args.seasons, args.first_season), fp, indent=4)
+    print("Wrote {} rounds to {}".format(len(written), args.results_directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,9 @@ setuptools.setup(
         'pyyaml==5.3.1',
         'golfgenius @ git+https://github.com/cswelton/golfgenius@master'
     ],
+    extras_require={
+        'fast': ['ujson']
+    },
     entry_points={
         "console_scripts": [
             'bbc-stats=bbc_stats.generate:main',
@@ -0,0 +1,127 @@
+"""
+Golden output of the rounds, players and power rankings for a fixed synthetic league.
+
+The fixture is regenerated after an intended output change with:
+
+    python -m tests.test_golden
+"""
+import os
+import io
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from synthetic import generate_results, points_config  # noqa: E402
+from bbc_stats.store import ResultsStore, default_year  # noqa: E402
+from bbc_stats.collection import RoundsCollection, PlayersCollection  # noqa: E402
+from bbc_stats.generate import PowerRankings, json_default_encoder  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "golden.json")
+# Every round is complete, scores and hole counts then mean the same to every golfgenius version
+LEAGUE = {"players": 12, "rounds": 8, "seed": 0, "incomplete_rate": 0}
+# Two-team rounds are too small and 4 rounds count, so invalid and replaced rounds are covered
+POINTS = {"min_players": 9, "season_round_count": 4, "replacement_scores": 2}
+RANKINGS = {"weighted_rounds": 2, "rankings_weights": [4, 5, 2]}
+
+
+def normalize(value):
+    """ JSON value of collection output, floats rounded so summation order does not matter """
+    if isinstance(value, float):
+        return round(value, 9)
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    return value
+
+
+def as_json(value):
+    return normalize(json.loads(json.dumps(value, default=json_default_encoder)))
+
+
+class League(object):
+    """ The synthetic league in a temporary results directory, with its site directory """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="bbc-golden-")
+        results_directory = os.path.join(self.directory, "results")
+        generate_results(results_directory, **LEAGUE)
+        self.points_config = points_config(**POINTS)
+        self.store = ResultsStore(results_directory, default_year=default_year(points_config=self.points_config))
+
+    def rounds(self):
+        collection = RoundsCollection(self.store, points_config=self.points_config)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rounds = collection.parse(self.directory)
+        return rounds, collection.invalid_rounds
+
+    def players(self, rounds):
+        collection = PlayersCollection(self.store, points_config=self.points_config)
+        collection.add_rounds(rounds)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return collection.parse(self.directory)
+
+    def power_rankings(self):
+        return PowerRankings(self.store, **RANKINGS).power_rankings()
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class GoldenOutputTest(unittest.TestCase):
+    maxDiff = None
+
+    @classmethod
+    def setUpClass(cls):
+        with open(FIXTURE, "r") as fp:
+            cls.golden = json.load(fp)
+        cls.league = League()
+        cls.rounds, cls.invalid_rounds = cls.league.rounds()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.league.close()
+
+    def test_rounds(self):
+        self.assertEqual(self.golden["rounds"], as_json(self.rounds))
+
+    def test_invalid_rounds(self):
+        self.assertEqual(self.golden["invalid_rounds"], as_json(self.invalid_rounds))
+
+    def test_players(self):
+        self.assertEqual(self.golden["players"], as_json(self.league.players(self.rounds)))
+
+    def test_power_rankings(self):
+        try:
+            import golfgenius.stats  # noqa: F401
+        except ImportError:
+            raise unittest.SkipTest("golfgenius is not installed")
+        self.assertEqual(self.golden["power_rankings"], as_json(self.league.power_rankings()))
+
+
+def main():
+    league = League()
+    try:
+        rounds, invalid_rounds = league.rounds()
+        golden = {
+            "rounds": as_json(rounds),
+            "invalid_rounds": as_json(invalid_rounds),
+            "players": as_json(league.players(rounds)),
+            "power_rankings": as_json(league.power_rankings())
+        }
+    finally:
+        league.close()
+    with open(FIXTURE, "w") as fp:
+        json.dump(golden, fp, indent=2, sort_keys=True)
+        fp.write("\n")
+    print("Wrote {}".format(FIXTURE))
+
+
+if __name__ == "__main__":
+    main()